@@ -0,0 +1,295 @@
+"""
+图片压缩基准测试
+生成可复现的合成图片集,在不同配置和进程数下运行 ImageCompressor,
+统计吞吐量、每张图片的编码次数、峰值内存和实际大小相对目标的误差
+
+用法:
+    python benchmark.py                          # 默认配置,结果打印到终端
+    python benchmark.py -o result.json           # 保存为JSON
+    python benchmark.py --compare baseline.json  # 与之前保存的结果对比,出现退化时返回1
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+from typing import Optional, List
+from PIL import Image, ImageDraw
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块,峰值内存记为 None
+    resource = None
+
+from main import ImageCompressor
+
+# 合成图片类型: 照片(JPEG)、平面图形(PNG)、带透明通道的图像(PNG)
+IMAGE_KINDS = ('photo', 'graphic', 'alpha')
+
+
+def _photo_image(width: int, height: int, rng: random.Random) -> Image.Image:
+    """类似照片的图像: 低分辨率随机噪声放大后叠加渐变和细粒度噪声"""
+    coarse_w, coarse_h = max(1, width // 32), max(1, height // 32)
+    coarse = Image.frombytes('RGB', (coarse_w, coarse_h), rng.randbytes(coarse_w * coarse_h * 3))
+    img = coarse.resize((width, height), Image.Resampling.BICUBIC)
+
+    gradient = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    img = Image.blend(img, gradient, 0.3)
+
+    grain_w, grain_h = max(1, width // 2), max(1, height // 2)
+    grain = Image.frombytes('RGB', (grain_w, grain_h), rng.randbytes(grain_w * grain_h * 3))
+    return Image.blend(img, grain.resize((width, height)), 0.12)
+
+
+def _graphic_image(width: int, height: int, rng: random.Random) -> Image.Image:
+    """平面图形: 纯色背景上的矩形、椭圆和线条"""
+    img = Image.new('RGB', (width, height), tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(60):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1, y1 = x0 + rng.randrange(width // 4 + 1), y0 + rng.randrange(height // 4 + 1)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        shape = rng.randrange(3)
+        if shape == 0:
+            draw.rectangle((x0, y0, x1, y1), fill=color)
+        elif shape == 1:
+            draw.ellipse((x0, y0, x1, y1), fill=color)
+        else:
+            draw.line((x0, y0, x1, y1), fill=color, width=max(1, width // 200))
+    return img
+
+
+def _alpha_image(width: int, height: int, rng: random.Random) -> Image.Image:
+    """带透明通道的图像: 照片式内容加径向渐变透明度"""
+    img = _photo_image(width, height, rng).convert('RGBA')
+    alpha = Image.radial_gradient('L').resize((width, height))
+    img.putalpha(alpha.point(lambda v: 255 - v))
+    return img
+
+
+def generate_corpus(folder: str, megapixels=(1, 4, 12), copies: int = 2, seed: int = 0) -> List[str]:
+    """
+    在 folder 中生成合成图片集,相同参数总是生成相同的文件
+
+    照片保存为高质量JPEG,平面图形和透明图像保存为PNG
+    """
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for mp in megapixels:
+        width = int((mp * 1_000_000 * 4 / 3) ** 0.5)
+        height = int(width * 3 / 4)
+        for kind in IMAGE_KINDS:
+            for index in range(copies):
+                name = f"{kind}_{mp}mp_{index}"
+                if kind == 'photo':
+                    path = os.path.join(folder, name + '.jpg')
+                    _photo_image(width, height, rng).save(path, 'JPEG', quality=95)
+                elif kind == 'graphic':
+                    path = os.path.join(folder, name + '.png')
+                    _graphic_image(width, height, rng).save(path, 'PNG')
+                else:
+                    path = os.path.join(folder, name + '.png')
+                    _alpha_image(width, height, rng).save(path, 'PNG')
+                paths.append(path)
+    return paths
+
+
+def _peak_rss_mb() -> Optional[float]:
+    """本进程与已结束子进程中的最大常驻内存(MB)"""
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux 上单位是KB,macOS 上是字节
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_one(config: dict) -> dict:
+    """
+    在当前进程中运行一个配置并返回指标
+
+    由 run_config 在独立子进程中调用,保证峰值内存互不影响
+    """
+    target_kb = config['target_kb']
+    compressor = ImageCompressor(
+        target_size_kb=target_kb,
+        threshold_kb=0,
+        probe_mode=config['probe_mode'],
+        profile=config.get('profile', False),
+    )
+    target_bytes = target_kb * 1024
+    errors = []
+
+    def collect(current, total, filename, result):
+        # 原图已小于目标的文件不参与误差统计
+        if result.success and not result.skipped and result.original_size > target_bytes:
+            errors.append((result.compressed_size - target_bytes) / target_bytes * 100)
+
+    with tempfile.TemporaryDirectory() as output_folder:
+        start = time.perf_counter()
+        summary = compressor.compress_folder(
+            config['corpus'], output_folder,
+            progress_callback=collect,
+            workers=config['workers'],
+        )
+        elapsed = time.perf_counter() - start
+    compressor.close()
+
+    compressed = summary.compressed
+    return {
+        'images': summary.total,
+        'compressed': compressed,
+        'failed': summary.failed,
+        'seconds': elapsed,
+        'images_per_sec': summary.total / elapsed if elapsed else 0,
+        'encodes_per_image': summary.encodes / compressed if compressed else 0,
+        'peak_rss_mb': _peak_rss_mb(),
+        'size_error_samples': len(errors),
+        'size_error_mean_abs_pct': sum(abs(e) for e in errors) / len(errors) if errors else 0,
+        'size_error_max_pct': max(errors) if errors else 0,
+        'over_target_fraction': sum(e > 0 for e in errors) / len(errors) if errors else 0,
+        'stages': {stage: stats.to_dict() for stage, stats in summary.stages.items()},
+    }
+
+
+def run_config(config: dict) -> dict:
+    """在子进程中运行一个配置,返回指标"""
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--run-one', json.dumps(config)],
+        check=True, stdout=subprocess.PIPE, text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def config_name(config: dict) -> str:
+    return f"{config['probe_mode']}/workers={config['workers']}/target={config['target_kb']}KB"
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    与基准结果对比,返回退化描述列表
+
+    吞吐量下降、编码次数增加或平均大小误差变大超过 tolerance(%)时视为退化
+    """
+    regressions = []
+    for name, current in results['runs'].items():
+        base = baseline.get('runs', {}).get(name)
+        if not base:
+            continue
+        checks = (
+            ('images_per_sec', -1),
+            ('encodes_per_image', 1),
+            ('size_error_mean_abs_pct', 1),
+        )
+        for key, direction in checks:
+            if not base[key]:
+                continue
+            change = (current[key] - base[key]) / base[key] * 100
+            print(f"  {name:40s} {key:26s} {base[key]:10.3f} -> {current[key]:10.3f} ({change:+.1f}%)")
+            if change * direction > tolerance:
+                regressions.append(f"{name} {key} {change:+.1f}%")
+    return regressions
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="图片压缩基准测试")
+    parser.add_argument('--corpus', help="图片集目录(默认在临时目录中生成)")
+    parser.add_argument('--megapixels', type=float, nargs='+', default=[1, 4, 12],
+                        help="生成的图片尺寸(百万像素,默认: 1 4 12)")
+    parser.add_argument('--copies', type=int, default=2, help="每种尺寸和类型生成的数量(默认: 2)")
+    parser.add_argument('--seed', type=int, default=0, help="随机种子(默认: 0)")
+    parser.add_argument('--probe-modes', nargs='+', default=['full', 'proxy'],
+                        choices=['full', 'proxy'], help="要测试的探测模式")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, os.cpu_count() or 1],
+                        help="要测试的进程数(默认: 1 和CPU核数)")
+    parser.add_argument('--targets', type=int, nargs='+', default=[200],
+                        help="目标大小KB(默认: 200)")
+    parser.add_argument('--profile', action='store_true', help="同时记录各阶段耗时")
+    parser.add_argument('-o', '--output', help="结果JSON文件")
+    parser.add_argument('--compare', metavar='BASELINE', help="与之前保存的结果JSON对比")
+    parser.add_argument('--tolerance', type=float, default=10,
+                        help="对比时允许的变化百分比(默认: 10)")
+    parser.add_argument('--run-one', help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+
+    if args.run_one:
+        print(json.dumps(run_one(json.loads(args.run_one))))
+        return 0
+
+    temp_dir = None
+    corpus = args.corpus
+    if not corpus or not os.path.isdir(corpus):
+        if not corpus:
+            temp_dir = tempfile.TemporaryDirectory()
+            corpus = temp_dir.name
+        print(f"生成图片集: {corpus}")
+        generate_corpus(corpus, args.megapixels, args.copies, args.seed)
+
+    results = {
+        'python': sys.version.split()[0],
+        'pillow': Image.__version__,
+        'cpu_count': os.cpu_count(),
+        'corpus': {
+            'megapixels': args.megapixels,
+            'copies': args.copies,
+            'seed': args.seed,
+            'files': sum(1 for p in Path(corpus).iterdir() if p.is_file()),
+        },
+        'runs': {},
+    }
+
+    try:
+        for target_kb in args.targets:
+            for probe_mode in args.probe_modes:
+                for workers in dict.fromkeys(args.workers):
+                    config = {'corpus': corpus, 'probe_mode': probe_mode,
+                              'workers': workers, 'target_kb': target_kb, 'profile': args.profile}
+                    name = config_name(config)
+                    metrics = run_config(config)
+                    results['runs'][name] = metrics
+                    rss = metrics['peak_rss_mb']
+                    print(f"{name:40s} {metrics['images_per_sec']:7.2f} 张/秒  "
+                          f"编码 {metrics['encodes_per_image']:5.2f} 次/张  "
+                          f"峰值内存 {'-' if rss is None else f'{rss:.0f}MB':>7s}  "
+                          f"大小误差 {metrics['size_error_mean_abs_pct']:5.1f}%  "
+                          f"超出目标 {metrics['over_target_fraction']:.0%}")
+                    for stage, stats in sorted(metrics['stages'].items(), key=lambda item: -item[1]['seconds']):
+                        print(f"    {stage:8s} {stats['seconds']:8.2f}s  {stats['calls']:6d}次  "
+                              f"平均 {stats['mean_ms']:8.1f}ms/文件")
+    finally:
+        if temp_dir:
+            temp_dir.cleanup()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存: {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"\n与 {args.compare} 对比:")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\n性能退化:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\n未发现退化")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
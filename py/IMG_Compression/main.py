@@ -1,27 +1,857 @@
 """
 图片批量压缩工具 - GUI版本
-单文件版本,带有图形界面
+单文件版本,带有图形界面,也可以在命令行中运行(python main.py --help)
 只在文件大小超过阈值时才进行压缩
 """
 
 import os
 import io
-import tkinter as tk
-from tkinter import ttk, filedialog, messagebox, scrolledtext
+import sys
+import csv
+import json
+import math
+import hashlib
+import shutil
+import signal
+import sqlite3
+import argparse
+import tempfile
+import time
+import struct
+import select
+import ctypes
+import ctypes.util
 from pathlib import Path
 from typing import Optional, List, Tuple
-from PIL import Image
+from PIL import Image, ImageOps, ExifTags, features
+import queue
 import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from datetime import datetime
 
+try:
+    import blake3
+    HAS_BLAKE3 = True
+except ImportError:
+    HAS_BLAKE3 = False
+
+# AVIF 需要 Pillow 11.3+ 且编译时带有 libavif
+HAS_AVIF = 'avif' in features.modules and features.check('avif')
+
+# tkinter 只在启动图形界面时导入,命令行模式和进程池工作进程都不加载
+tk = ttk = filedialog = messagebox = scrolledtext = None
+
+
+def _import_tk():
+    """导入图形界面所需的 tkinter 模块"""
+    global tk, ttk, filedialog, messagebox, scrolledtext
+    import tkinter as tk
+    from tkinter import ttk, filedialog, messagebox, scrolledtext
+
+
+class EncodeBufferPool:
+    """
+    编码缓冲区池
+    
+    探测编码只需要 tell() 得到的大小,缓冲区每次从头覆盖写入、从不截断,
+    因此在探测之间、文件之间复用时不会重新分配内存
+    """
+    
+    def __init__(self, max_buffers: int = 4, max_retained_bytes: int = 32 * 1024 * 1024):
+        self.max_buffers = max_buffers
+        self.max_retained_bytes = max_retained_bytes
+        self._free = []
+        self._lock = threading.Lock()
+    
+    def acquire(self) -> io.BytesIO:
+        """取出一个缓冲区,写入位置已重置到开头"""
+        with self._lock:
+            buffer = self._free.pop() if self._free else io.BytesIO()
+        buffer.seek(0)
+        return buffer
+    
+    def release(self, buffer: io.BytesIO):
+        """归还缓冲区,超出数量或体积上限的直接丢弃"""
+        with self._lock:
+            if (len(self._free) < self.max_buffers
+                    and buffer.getbuffer().nbytes <= self.max_retained_bytes):
+                self._free.append(buffer)
+
+
+# 增量缓存数据库默认文件名(GUI中放在输入文件夹下)
+CACHE_FILENAME = '.img_compression_cache.db'
+
+# 断点日志默认文件名(放在输入文件夹下)
+JOURNAL_FILENAME = '.img_compression_journal.jsonl'
+
+# 可选的输出格式
+OUTPUT_FORMATS = ['JPEG', 'PNG', 'WEBP'] + (['AVIF'] if HAS_AVIF else [])
+
+
+def format_extension(output_format: str) -> str:
+    """输出格式对应的文件扩展名"""
+    ext = '.' + output_format.lower()
+    return '.jpg' if ext == '.jpeg' else ext
+
+
+# 每个进程一个缓冲区池,同一工作进程处理的所有文件共用
+_buffer_pool = EncodeBufferPool()
+
+
+# IJG 标准亮度量化表(质量50),libjpeg 等编码器按质量对它整体缩放
+_IJG_LUMINANCE_TABLE = (
+    16, 11, 10, 16, 24, 40, 51, 61,
+    12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56,
+    14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77,
+    24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101,
+    72, 92, 95, 98, 112, 100, 103, 99,
+)
+
+
+def estimate_jpeg_quality(quantization: dict) -> Optional[int]:
+    """
+    根据文件头中的量化表估计JPEG的编码质量(1-100)
+    
+    按 IJG 的缩放公式反推:亮度表与标准表的平均比例 S(%) 对应质量
+    (200-S)/2 (S≤100) 或 5000/S。非 IJG 编码器的表也能得到大致相当的质量
+    """
+    table = quantization.get(0) if quantization else None
+    if not table or len(table) != 64:
+        return None
+    scale = sum(table) / sum(_IJG_LUMINANCE_TABLE) * 100
+    quality = (200 - scale) / 2 if scale <= 100 else 5000 / scale
+    return min(max(round(quality), 1), 100)
+
+
+def content_hash(file_path: str) -> str:
+    """计算文件内容哈希,优先使用BLAKE3,未安装时退回 hashlib 的 BLAKE2b"""
+    hasher = blake3.blake3() if HAS_BLAKE3 else hashlib.blake2b()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(chunk)
+    prefix = 'blake3' if HAS_BLAKE3 else 'blake2b'
+    return f'{prefix}:{hasher.hexdigest()}'
+
+
+def iter_image_files(folder: str, recursive: bool = True, formats=None):
+    """
+    用 os.scandir 流式遍历文件夹,逐个产出 (路径, stat) 
+    
+    只对扩展名匹配的文件取 stat,并复用 DirEntry 缓存的信息(Windows上无需额外系统调用);
+    不预先收集列表,第一个文件找到后即可开始处理。不跟随指向目录的符号链接,避免循环
+    """
+    formats = formats or ImageCompressor.SUPPORTED_FORMATS
+    stack = [folder]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                subdirs = []
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive:
+                                subdirs.append(entry.path)
+                        elif os.path.splitext(entry.name)[1].lower() in formats and entry.is_file():
+                            yield entry.path, entry.stat()
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+        # 逆序入栈,使子文件夹按目录顺序处理
+        stack.extend(reversed(subdirs))
+
+
+class FileCountEstimator:
+    """在后台线程中统计待处理文件总数,为流式处理的进度条提供总数估计"""
+    
+    def __init__(self, folder: str, recursive: bool = True, formats=None):
+        self.count = 0
+        self.done = False
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, args=(folder, recursive, formats), daemon=True)
+        self._thread.start()
+    
+    def _run(self, folder, recursive, formats):
+        for _ in iter_image_files(folder, recursive, formats):
+            if self._stopped:
+                return
+            self.count += 1
+        self.done = True
+    
+    def stop(self):
+        self._stopped = True
+
+
+class FolderWatcher:
+    """
+    监视文件夹中新增或修改的图片文件
+    
+    Linux 上通过 ctypes 调用 inotify,事件到达即可唤醒;其他平台、inotify 不可用
+    或指定了 poll_interval 时退回定期扫描并比较大小和修改时间
+    """
+    
+    IN_MODIFY = 0x002
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_Q_OVERFLOW = 0x4000
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    
+    def __init__(self, folder: str, recursive: bool = True, formats=None,
+                 poll_interval: Optional[float] = None, exclude: Optional[str] = None):
+        """
+        Args:
+            poll_interval: 轮询间隔(秒);为None时优先使用 inotify,不可用时按2秒轮询
+            exclude: 不监视的子文件夹(如位于输入文件夹内的输出文件夹)
+        """
+        self.folder = folder
+        self.recursive = recursive
+        self.formats = formats or ImageCompressor.SUPPORTED_FORMATS
+        self.exclude = os.path.abspath(exclude) if exclude else None
+        self.poll_interval = poll_interval or 2.0
+        self.fd = None
+        self.watches = {}
+        self.snapshot = {}
+        
+        if poll_interval is None and sys.platform.startswith('linux'):
+            try:
+                self._init_inotify()
+            except OSError:
+                self.fd = None
+        if self.fd is None:
+            self.snapshot = self._scan()
+        self._last_poll = time.monotonic()
+    
+    @property
+    def backend(self) -> str:
+        return 'inotify' if self.fd is not None else 'polling'
+    
+    def _excluded(self, path: str) -> bool:
+        if self.exclude is None:
+            return False
+        path = os.path.abspath(path)
+        return path == self.exclude or path.startswith(self.exclude + os.sep)
+    
+    def _is_image(self, path: str) -> bool:
+        return os.path.splitext(path)[1].lower() in self.formats
+    
+    def _scan(self) -> dict:
+        return {path: (stat.st_size, stat.st_mtime_ns)
+                for path, stat in iter_image_files(self.folder, self.recursive, self.formats)
+                if not self._excluded(path)}
+    
+    def _init_inotify(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._libc = libc
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 失败')
+        self.fd = fd
+        self._add_watch(self.folder)
+    
+    def _add_watch(self, directory: str):
+        """监视目录(递归时包括全部子目录),返回添加监视前已存在的图片文件"""
+        found = []
+        stack = [directory]
+        while stack:
+            current = stack.pop()
+            if self._excluded(current):
+                continue
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(current), self.WATCH_MASK)
+            if wd < 0:
+                continue
+            self.watches[wd] = current
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            if self.recursive:
+                                stack.append(entry.path)
+                        elif self._is_image(entry.name):
+                            found.append(entry.path)
+            except OSError:
+                continue
+        return found
+    
+    def poll(self, timeout: float) -> List[str]:
+        """等待至多 timeout 秒,返回期间新增或修改过的图片路径"""
+        if self.fd is None:
+            return self._poll_scan(timeout)
+        
+        changed = []
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return changed
+        
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        
+        offset = 0
+        while offset + 16 <= len(data):
+            wd, mask, _, length = struct.unpack_from('iIII', data, offset)
+            name = data[offset + 16:offset + 16 + length].rstrip(b'\0')
+            offset += 16 + length
+            
+            if mask & self.IN_Q_OVERFLOW:
+                # 事件队列溢出,丢失的事件只能通过全量扫描找回
+                changed.extend(self._scan())
+                continue
+            directory = self.watches.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            
+            if mask & self.IN_ISDIR:
+                if self.recursive and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    # 新目录在添加监视前就可能已经写入了文件
+                    changed.extend(self._add_watch(path))
+            elif self._is_image(path) and not self._excluded(path):
+                changed.append(path)
+        return changed
+    
+    def _poll_scan(self, timeout: float) -> List[str]:
+        wait_time = self._last_poll + self.poll_interval - time.monotonic()
+        if wait_time > timeout:
+            time.sleep(max(timeout, 0))
+            return []
+        time.sleep(max(wait_time, 0))
+        self._last_poll = time.monotonic()
+        
+        snapshot = self._scan()
+        changed = [path for path, signature in snapshot.items() if self.snapshot.get(path) != signature]
+        self.snapshot = snapshot
+        return changed
+    
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def _default_file_mode() -> int:
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+# 新建文件的默认权限(受 umask 影响)
+_DEFAULT_FILE_MODE = _default_file_mode()
+
+
+def _ignore_sigint():
+    """进程池工作进程的初始化函数:忽略 Ctrl+C,由主进程负责中断和关闭进程池"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _terminate_pool(executor: ProcessPoolExecutor):
+    """
+    中断时立即关闭进程池:取消排队的任务并终止工作进程
+    
+    否则退出时要等在途的任务全部完成。输出经 write_atomic 写入,终止不会留下不完整的目标文件
+    """
+    processes = list((executor._processes or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+
+
+def write_atomic(path: str, write):
+    """
+    先写入同目录下的临时文件再重命名覆盖目标文件
+    
+    覆盖原文件时即使中途崩溃,目标路径上也只会是完整的旧文件或完整的新文件
+    
+    Args:
+        write: 接收已打开的临时文件对象并写入内容的函数
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        # mkstemp 创建的文件权限为0600,改为与被覆盖的文件一致,新文件按 umask 取默认权限
+        try:
+            mode = os.stat(path).st_mode & 0o7777
+        except FileNotFoundError:
+            mode = _DEFAULT_FILE_MODE
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class DuplicateTracker:
+    """
+    识别内容完全相同的输入文件,相同内容只压缩一次
+    
+    先按文件大小分桶:大小第一次出现的文件不计算哈希,同一大小出现第二个文件时才计算
+    两者的内容哈希(与 b3sum 工具相同的 BLAKE3,未安装时用 BLAKE2b)。
+    覆盖原文件时,首个文件压缩后内容就变了,因此每个文件都立即计算哈希
+    """
+    
+    def __init__(self, eager: bool = False):
+        self.eager = eager
+        self.by_size = {}   # 文件大小 -> [[路径, 内容哈希或None], ...]
+        self.primaries = set()  # 已登记为新内容、需要保存结果的文件路径
+        self.results = {}   # 首个文件路径 -> 压缩结果
+        self.waiting = {}   # 首个文件路径 -> 等待复用其结果的 [(路径, 输出路径, stat), ...]
+    
+    def primary_for(self, path: str, size: int) -> Optional[str]:
+        """返回内容相同的先前文件;没有时把该文件登记为新内容并返回None"""
+        entries = self.by_size.setdefault(size, [])
+        digest = content_hash(path) if entries or self.eager else None
+        for entry in entries:
+            if entry[1] is None:
+                try:
+                    entry[1] = content_hash(entry[0])
+                except OSError:
+                    entry[1] = ''
+            if entry[1] == digest:
+                return entry[0]
+        entries.append([path, digest])
+        self.primaries.add(path)
+        return None
+
+
+class JobJournal:
+    """
+    批量任务的断点日志
+    
+    每完成一个文件追加一行并立即 flush,任务被取消或进程崩溃后已完成的记录都在磁盘上;
+    续传时跳过日志中的文件。崩溃时最后一行可能只写了一半,读取时忽略。
+    任务完整结束后日志文件被删除,下次运行重新开始
+    """
+    
+    FSYNC_INTERVAL = 100
+    
+    def __init__(self, path: str, job_key: str, resume: bool = False):
+        self.path = path
+        self.completed = set()
+        self._unsynced = 0
+        
+        if resume and os.path.exists(path):
+            self._load(job_key)
+            self.file = open(path, 'a', encoding='utf-8')
+            # 补上被截断的最后一行的换行,避免新记录拼接到半行后面
+            if self.file.tell() and not self._ends_with_newline():
+                self.file.write('\n')
+        else:
+            self.file = open(path, 'w', encoding='utf-8')
+            self.file.write(json.dumps({'job': job_key}, ensure_ascii=False) + '\n')
+            self.file.flush()
+    
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+    
+    def _load(self, job_key: str):
+        with open(self.path, encoding='utf-8') as f:
+            try:
+                header = json.loads(f.readline())
+            except ValueError:
+                header = {}
+            if header.get('job') != job_key:
+                raise ValueError(f"任务日志 {self.path} 的参数与当前参数不一致,无法续传")
+            
+            for line in f:
+                try:
+                    self.completed.add(json.loads(line)['path'])
+                except (ValueError, KeyError):
+                    continue
+    
+    def __contains__(self, path: str) -> bool:
+        return path in self.completed
+    
+    def record(self, path: str):
+        """记录一个已完成的文件"""
+        self.file.write(json.dumps({'path': path}, ensure_ascii=False) + '\n')
+        self.file.flush()
+        self._unsynced += 1
+        if self._unsynced >= self.FSYNC_INTERVAL:
+            os.fsync(self.file.fileno())
+            self._unsynced = 0
+    
+    def close(self, finished: bool = False):
+        """关闭日志;finished 为 True 表示任务已全部完成,删除日志文件"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        if finished:
+            os.remove(self.path)
+
+
+class CompressionCache:
+    """
+    增量压缩清单(SQLite)
+    
+    以输入路径为键,记录本次运行后该路径上文件的大小/修改时间(可选内容哈希)
+    以及压缩参数和选中的质量。再次运行时文件未变且参数相同即可直接跳过;
+    只有目标大小小幅变化时,之前找到的质量作为搜索起点复用
+    """
+    
+    COMMIT_INTERVAL = 200
+    
+    def __init__(self, db_path: str, use_content_hash: bool = False):
+        self.db_path = db_path
+        self.use_content_hash = use_content_hash
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                content_hash TEXT,
+                settings TEXT NOT NULL,
+                target_kb REAL NOT NULL,
+                quality INTEGER NOT NULL,
+                in_place INTEGER NOT NULL,
+                output_path TEXT NOT NULL,
+                original_size INTEGER NOT NULL,
+                compressed_size INTEGER NOT NULL
+            )
+        ''')
+        self._pending = 0
+    
+    def lookup(self, path: str, settings: str) -> Optional[dict]:
+        """查询路径对应的记录,参数不同的记录视为不存在"""
+        row = self.conn.execute(
+            'SELECT size, mtime_ns, content_hash, target_kb, quality, in_place, output_path, '
+            'original_size, compressed_size FROM files WHERE path = ? AND settings = ?',
+            (path, settings)).fetchone()
+        if row is None:
+            return None
+        keys = ('size', 'mtime_ns', 'content_hash', 'target_kb', 'quality', 'in_place',
+                'output_path', 'original_size', 'compressed_size')
+        return dict(zip(keys, row))
+    
+    def is_unchanged(self, entry: dict, path: str, stat: os.stat_result) -> bool:
+        """路径上的文件是否仍是上次运行结束时的状态"""
+        if entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return True
+        # 大小相同但修改时间变了(如被复制或touch)时,再用内容哈希确认
+        if self.use_content_hash and entry['content_hash'] and entry['size'] == stat.st_size:
+            return content_hash(path) == entry['content_hash']
+        return False
+    
+    def record(self, path: str, settings: str, target_kb: float, result: 'CompressionResult'):
+        """记录一次成功压缩的结果"""
+        stat = os.stat(path)
+        digest = content_hash(path) if self.use_content_hash else None
+        # 保留原文件的结果没有编码质量,记为100(读取时按大小未变识别,不作为质量起点)
+        quality = result.quality if result.quality is not None else 100
+        self.conn.execute(
+            'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (path, stat.st_size, stat.st_mtime_ns, digest, settings, target_kb, quality,
+             int(os.path.abspath(result.output_path) == os.path.abspath(path)),
+             result.output_path, result.original_size, result.compressed_size))
+        
+        self._pending += 1
+        if self._pending >= self.COMMIT_INTERVAL:
+            self.flush()
+    
+    def flush(self):
+        """提交未写入的记录"""
+        self.conn.commit()
+        self._pending = 0
+    
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+class CompressionResult:
+    """
+    单个文件的压缩结果
+    
+    使用 __slots__ 让大批量运行时每条结果的内存占用保持很小;
+    同时支持 result['key'] 和 result.get('key') 的字典式访问
+    """
+    
+    __slots__ = ('success', 'skipped', 'cached', 'kept_original', 'input_path', 'output_path',
+                 'original_size', 'compressed_size', 'quality', 'predicted_size', 'encodes', 'timings',
+                 'duplicate_of', 'rendition', 'error', 'message')
+    
+    def __init__(self, success: bool, input_path: str, message: str, skipped: bool = False,
+                 cached: bool = False, kept_original: bool = False,
+                 output_path: Optional[str] = None, original_size: int = 0,
+                 compressed_size: int = 0, quality: Optional[int] = None,
+                 predicted_size: Optional[int] = None, encodes: Optional[int] = None,
+                 timings: Optional[dict] = None, duplicate_of: Optional[str] = None,
+                 rendition: Optional[str] = None, error: Optional[str] = None):
+        self.success = success
+        self.skipped = skipped
+        self.cached = cached
+        self.kept_original = kept_original
+        self.input_path = input_path
+        self.output_path = output_path
+        self.original_size = original_size
+        self.compressed_size = compressed_size
+        self.quality = quality
+        self.predicted_size = predicted_size
+        self.encodes = encodes
+        self.timings = timings
+        self.duplicate_of = duplicate_of
+        self.rendition = rendition
+        self.error = error
+        self.message = message
+    
+    @property
+    def compression_ratio(self) -> float:
+        """压缩率(%)"""
+        if not self.success or not self.original_size:
+            return 0
+        return (1 - self.compressed_size / self.original_size) * 100
+    
+    def __getitem__(self, key: str):
+        if key != 'compression_ratio' and key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def get(self, key: str, default=None):
+        value = getattr(self, key, None) if key == 'compression_ratio' or key in self.__slots__ else None
+        return default if value is None else value
+    
+    def to_dict(self) -> dict:
+        """转换为字典,省略为None的字段"""
+        data = {key: getattr(self, key) for key in self.__slots__ if getattr(self, key) is not None}
+        if self.success:
+            data['compression_ratio'] = self.compression_ratio
+        return data
+
+
+class Rendition:
+    """
+    多规格输出中的一种规格
+    
+    每种规格有自己的名称(用作输出文件名后缀)、目标大小、最长边上限和输出格式
+    """
+    
+    __slots__ = ('name', 'target_kb', 'max_dimension', 'format')
+    
+    def __init__(self, name: str, target_kb: float, max_dimension: Optional[int] = None,
+                 format: Optional[str] = None):
+        if not name or not all(c.isalnum() or c in '-_' for c in name):
+            raise ValueError(f"规格名称只能包含字母、数字、- 和 _: {name!r}")
+        if target_kb <= 0 or (max_dimension is not None and max_dimension <= 0):
+            raise ValueError(f"规格 {name} 的目标大小和最长边必须大于0")
+        if format is not None and format.upper() not in OUTPUT_FORMATS:
+            raise ValueError(f"规格 {name} 的输出格式不支持: {format}")
+        self.name = name
+        self.target_kb = target_kb
+        self.max_dimension = max_dimension
+        self.format = format.upper() if format else None
+    
+    @classmethod
+    def parse(cls, text: str) -> 'Rendition':
+        """解析命令行写法 名称:目标KB[:最长边[:格式]],如 thumb:30:320:WEBP"""
+        parts = text.split(':')
+        if not 2 <= len(parts) <= 4:
+            raise ValueError(f"规格格式应为 名称:目标KB[:最长边[:格式]]: {text}")
+        max_dimension = int(parts[2]) if len(parts) > 2 and parts[2] else None
+        return cls(parts[0], float(parts[1]), max_dimension, parts[3] if len(parts) > 3 else None)
+
+
+class StageStats:
+    """
+    单个处理阶段在整个批次上的耗时统计
+    
+    每个文件该阶段的总耗时按2的幂(毫秒)分桶计数,便于看出长尾
+    """
+    
+    def __init__(self):
+        self.files = 0
+        self.calls = 0
+        self.seconds = 0.0
+        self.bytes = 0
+        self.max_seconds = 0.0
+        self.histogram = {}
+    
+    def add(self, seconds: float, nbytes: int, calls: int):
+        """累加一个文件在该阶段的耗时"""
+        self.files += 1
+        self.calls += calls
+        self.seconds += seconds
+        self.bytes += nbytes
+        self.max_seconds = max(self.max_seconds, seconds)
+        bucket = 1
+        while bucket < seconds * 1000:
+            bucket *= 2
+        self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+    
+    def to_dict(self) -> dict:
+        return {
+            'files': self.files,
+            'calls': self.calls,
+            'seconds': self.seconds,
+            'mean_ms': self.seconds / self.files * 1000 if self.files else 0,
+            'max_ms': self.max_seconds * 1000,
+            'bytes': self.bytes,
+            'mb_per_sec': self.bytes / 1024 / 1024 / self.seconds if self.seconds else 0,
+            'histogram_ms': {f'<={bucket}': self.histogram[bucket] for bucket in sorted(self.histogram)},
+        }
+
+
+class CompressionSummary:
+    """批量压缩的运行汇总,逐条累加而不保存每个文件的结果"""
+    
+    def __init__(self):
+        self.total = 0
+        self.compressed = 0
+        self.skipped = 0
+        self.cached = 0
+        self.deduplicated = 0
+        self.failed = 0
+        self.original_bytes = 0
+        self.compressed_bytes = 0
+        self.ratio_sum = 0.0
+        self.proxy_samples = 0
+        self.proxy_error_sum = 0.0
+        self.proxy_abs_error_sum = 0.0
+        self.proxy_max_abs_error = 0.0
+        self.proxy_within_window = 0
+        self.encodes = 0
+        self.stages = {}
+    
+    def add(self, result: CompressionResult):
+        """累加一条结果"""
+        self.total += 1
+        if not result.success:
+            self.failed += 1
+            return
+        if result.skipped:
+            self.skipped += 1
+            self.cached += result.cached
+            return
+        
+        self.compressed += 1
+        self.deduplicated += result.duplicate_of is not None
+        self.original_bytes += result.original_size
+        self.compressed_bytes += result.compressed_size
+        self.ratio_sum += result.compression_ratio
+        self.encodes += result.encodes or 0
+        
+        if result.timings:
+            for stage, entry in result.timings.items():
+                self.stages.setdefault(stage, StageStats()).add(entry['seconds'], entry['bytes'], entry['calls'])
+        
+        if result.predicted_size is not None and result.compressed_size:
+            error = (result.predicted_size - result.compressed_size) / result.compressed_size * 100
+            self.proxy_samples += 1
+            self.proxy_error_sum += error
+            self.proxy_abs_error_sum += abs(error)
+            self.proxy_max_abs_error = max(self.proxy_max_abs_error, abs(error))
+            self.proxy_within_window += abs(error) <= 5
+    
+    @property
+    def saved_bytes(self) -> int:
+        return self.original_bytes - self.compressed_bytes
+    
+    @property
+    def average_ratio(self) -> float:
+        """已压缩文件的平均压缩率(%)"""
+        return self.ratio_sum / self.compressed if self.compressed else 0
+    
+    def proxy_accuracy(self) -> dict:
+        """
+        代理探测的预测精度(预测大小 vs 实际大小,单位%)
+        
+        用于对照搜索使用的±5%目标窗口调节 proxy_pixels
+        """
+        if not self.proxy_samples:
+            return {'samples': 0}
+        return {
+            'samples': self.proxy_samples,
+            'mean_error': self.proxy_error_sum / self.proxy_samples,
+            'mean_abs_error': self.proxy_abs_error_sum / self.proxy_samples,
+            'max_abs_error': self.proxy_max_abs_error,
+            'within_window': self.proxy_within_window / self.proxy_samples,
+        }
+    
+    def stage_report(self) -> List[str]:
+        """各阶段耗时汇总的文本行,按总耗时降序排列"""
+        total = sum(stats.seconds for stats in self.stages.values())
+        lines = []
+        for stage, stats in sorted(self.stages.items(), key=lambda item: -item[1].seconds):
+            share = stats.seconds / total * 100 if total else 0
+            lines.append(f"{stage:8s} {stats.seconds:8.2f}s ({share:4.1f}%)  "
+                         f"{stats.calls:6d}次  平均 {stats.seconds / stats.files * 1000:8.1f}ms/文件  "
+                         f"最长 {stats.max_seconds * 1000:8.1f}ms  "
+                         f"{stats.bytes / 1024 / 1024:9.1f}MB")
+        return lines
+    
+    def to_dict(self) -> dict:
+        return {
+            'total': self.total,
+            'compressed': self.compressed,
+            'skipped': self.skipped,
+            'cached': self.cached,
+            'deduplicated': self.deduplicated,
+            'failed': self.failed,
+            'original_bytes': self.original_bytes,
+            'compressed_bytes': self.compressed_bytes,
+            'saved_bytes': self.saved_bytes,
+            'average_ratio': self.average_ratio,
+            'encodes': self.encodes,
+            'proxy_accuracy': self.proxy_accuracy(),
+            'stages': {stage: stats.to_dict() for stage, stats in self.stages.items()},
+        }
+
+
+class ResultLog:
+    """边处理边写入的结果日志,扩展名为 .csv 时写CSV,否则每行一个JSON"""
+    
+    CSV_FIELDS = ('input_path', 'output_path', 'success', 'skipped', 'cached', 'kept_original', 'original_size',
+                  'compressed_size', 'compression_ratio', 'quality', 'predicted_size', 'encodes', 'duplicate_of',
+                  'rendition', 'message')
+    
+    def __init__(self, path: str):
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.csv_writer = None
+        if path.lower().endswith('.csv'):
+            self.csv_writer = csv.DictWriter(self.file, fieldnames=self.CSV_FIELDS, extrasaction='ignore')
+            self.csv_writer.writeheader()
+    
+    def write(self, result: CompressionResult):
+        if self.csv_writer:
+            self.csv_writer.writerow(result.to_dict())
+        else:
+            self.file.write(json.dumps(result.to_dict(), ensure_ascii=False) + '\n')
+    
+    def close(self):
+        self.file.close()
+
 
 class ImageCompressor:
     """图片压缩器类"""
     
-    SUPPORTED_FORMATS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tiff'}
+    SUPPORTED_FORMATS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tif', '.tiff'} | ({'.avif'} if HAS_AVIF else set())
+    
+    # 支持透明通道的输出格式,转换时保留 alpha
+    ALPHA_FORMATS = {'PNG', 'WEBP', 'AVIF'}
+    
+    # WebP/AVIF 默认的编码力度(WebP 的 method,0最快、6最慢最小)
+    DEFAULT_EFFORT = 4
     
     def __init__(self, target_size_kb: float = 200, threshold_kb: float = 300, 
-                 quality_range: Tuple[int, int] = (20, 95)):
+                 quality_range: Tuple[int, int] = (20, 95), probe_mode: str = 'full',
+                 proxy_pixels: int = 1_000_000, cache_path: Optional[str] = None,
+                 cache_content_hash: bool = False, profile: bool = False, png_dither: bool = False,
+                 effort: int = DEFAULT_EFFORT, probe_effort: Optional[int] = None,
+                 size_guard: bool = False, keep_metadata: bool = False, auto_orient: bool = False):
         """
         初始化压缩器
         
@@ -29,136 +859,1185 @@ class ImageCompressor:
             target_size_kb: 目标文件大小(KB)
             threshold_kb: 阈值大小(KB),只有超过这个大小的文件才会被压缩
             quality_range: 质量范围 (最小质量, 最大质量)
+            probe_mode: 探测模式,'full' 每次探测都编码整图;'proxy' 只编码代表性分块拼图,
+                按每像素字节数外推整图大小,选定质量后只做一次整图编码
+            proxy_pixels: 代理模式下拼图的总像素数
+            cache_path: 增量压缩清单(SQLite)路径,为None时不使用缓存
+            cache_content_hash: 缓存是否额外记录内容哈希,修改时间变化但内容未变的文件也能跳过
+            profile: 是否记录每个文件各阶段(解码、模式转换、代理拼图、探测编码、缩放、写入)的耗时和字节数
+            png_dither: PNG 调色板量化时是否使用 Floyd-Steinberg 抖动(仅不透明图片)
+            effort: WebP/AVIF 最终编码的力度,0-6,对应 WebP 的 method;AVIF 换算为 speed
+            probe_effort: 探测编码使用的力度,默认与 effort 相同。设得更低时探测更快,
+                选定质量后以 effort 重新编码写盘(大小偏离目标窗口时逐级调整质量)
+            size_guard: 输出格式与原图相同时,重新编码的结果不比原文件小就保留原文件;
+                原文件已在目标窗口内时不解码直接保留
+            keep_metadata: 是否在输出中保留原图的 EXIF 和 ICC 配置文件,默认全部去除
+            auto_orient: 是否在解码时按 EXIF 方向旋转图像,输出中的方向标记随之复位
         """
+        if probe_mode not in ('full', 'proxy'):
+            raise ValueError(f"不支持的探测模式: {probe_mode}")
+        if probe_effort is None:
+            probe_effort = effort
+        if not (0 <= effort <= 6 and 0 <= probe_effort <= 6):
+            raise ValueError("编码力度必须在0-6之间")
         self.target_size_kb = target_size_kb
         self.target_size_bytes = target_size_kb * 1024
         self.threshold_kb = threshold_kb
         self.threshold_bytes = threshold_kb * 1024
         self.min_quality = quality_range[0]
         self.max_quality = quality_range[1]
+        self.probe_mode = probe_mode
+        self.proxy_pixels = proxy_pixels
+        self.cache = CompressionCache(cache_path, cache_content_hash) if cache_path else None
+        # 累计编码次数(探测和最终写入),用于统计每张图片的编码开销
+        self.encode_count = 0
+        self.profile = profile
+        self.png_dither = png_dither
+        self.effort = effort
+        self.probe_effort = probe_effort
+        self.size_guard = size_guard
+        self.keep_metadata = keep_metadata
+        self.auto_orient = auto_orient
+        # 当前文件写盘时附带的元数据(exif/icc_profile),不保留元数据时为空
+        self.metadata = {}
+        # 当前文件的阶段统计 {阶段: [秒, 字节数, 次数]},未开启 profile 时为None
+        self.timings = None
     
-    def get_file_size(self, img: Image.Image, quality: int, format: str = 'JPEG') -> int:
-        """获取指定质量下的图片文件大小"""
-        buffer = io.BytesIO()
-        save_kwargs = {'quality': quality, 'optimize': True}
+    # 目标大小变化不超过该比例时复用缓存中的质量作为搜索起点
+    HINT_TARGET_TOLERANCE = 0.2
+    
+    # 缩放时为换取更高质量最多可再缩小到的尺寸比例(1.0表示始终保持最大尺寸)
+    RESIZE_MIN_DIMENSION_RATIO = 0.85
+    # 采用更小尺寸所需的最低质量提升
+    RESIZE_MIN_QUALITY_GAIN = 5
+    # 每个质量下缩放比例搜索的最多编码次数
+    MAX_SCALE_STEPS = 4
+    
+    # 最低质量下每像素字节数的典型估计,用于解码前预测缩放比例。
+    # 平滑的图片实际可低一个数量级,按预测降采样后须用一次编码确认(见 _reduce_confirmed)
+    MIN_QUALITY_BYTES_PER_PIXEL = 0.05
+    # 最低质量下相对原文件大小的典型估计
+    MIN_QUALITY_SIZE_RATIO = 0.25
+    
+    # 典型照片的JPEG大小随质量的变化(相对质量75),用于由原文件质量预测目标质量
+    JPEG_SIZE_CURVE = ((10, 0.12), (20, 0.3), (30, 0.45), (40, 0.57), (50, 0.67), (60, 0.78),
+                       (70, 0.92), (75, 1.0), (80, 1.12), (85, 1.3), (90, 1.6), (95, 2.3), (100, 4.0))
+    # 预测的最低质量大小超过目标的倍数达到该值时,跳过质量探测直接缩放
+    PRECLASSIFY_RESIZE_MARGIN = 1.5
+    
+    # 估计峰值内存时每像素的字节数(4字节像素 × 约3份同时存在的图像)
+    MEMORY_BYTES_PER_PIXEL = 12
+    
+    # PNG 固定使用的 zlib 压缩级别:级别只影响几个百分点的大小,不值得搜索
+    PNG_COMPRESS_LEVEL = 6
+    
+    # 流式读取 TIFF 时一次解码的区域大小上限(字节)
+    STREAM_REGION_BYTES = 32 * 1024 * 1024
+    # 可以流式读取并用 reduce 缩小的图像模式
+    STREAM_MODES = ('L', 'LA', 'RGB', 'RGBA', 'CMYK', 'I', 'F')
+    
+    def __getstate__(self):
+        # 数据库连接不能跨进程传递,缓存只在主进程中读写
+        state = self.__dict__.copy()
+        state['cache'] = None
+        return state
+    
+    def close(self):
+        """关闭增量缓存"""
+        if self.cache:
+            self.cache.close()
+            self.cache = None
+    
+    def settings_key(self, output_format: Optional[str] = None) -> str:
+        """缓存使用的参数标识(不含目标大小,目标大小单独比较)"""
+        key = (f'threshold={self.threshold_kb}|quality={self.min_quality}-{self.max_quality}'
+               f'|format={output_format or "keep"}|probe={self.probe_mode}')
+        if self.png_dither:
+            key += '|dither'
+        if (self.effort, self.probe_effort) != (self.DEFAULT_EFFORT, self.DEFAULT_EFFORT):
+            key += f'|effort={self.effort}/{self.probe_effort}'
+        if self.size_guard:
+            key += '|guard'
+        if self.keep_metadata:
+            key += '|metadata'
+        if self.auto_orient:
+            key += '|orient'
+        return key
+    
+    def _record_stage(self, stage: str, start: float, nbytes: int = 0):
+        """把从 start 到现在的耗时计入当前文件的某个阶段,未开启 profile 时不做任何事"""
+        if self.timings is None:
+            return
+        entry = self.timings.setdefault(stage, [0.0, 0, 0])
+        entry[0] += time.perf_counter() - start
+        entry[1] += nbytes
+        entry[2] += 1
+    
+    def _save_kwargs(self, quality: int, format: str, final: bool = True) -> dict:
+        """
+        指定质量下的保存参数(PNG 的质量体现在调色板颜色数上,见 _png_image)
         
+        final 为False时是探测编码,WebP/AVIF 使用 probe_effort。
+        保留元数据时每次编码都带上元数据,探测到的大小就是写盘后的大小
+        """
+        effort = self.effort if final else self.probe_effort
         if format == 'PNG':
-            compress_level = int((100 - quality) / 100 * 9)
-            save_kwargs = {'compress_level': compress_level, 'optimize': True}
+            kwargs = {'compress_level': self.PNG_COMPRESS_LEVEL}
+        elif format == 'WEBP':
+            kwargs = {'quality': quality, 'method': effort}
+        elif format == 'AVIF':
+            # AVIF 的 speed 为0(最慢)-10(最快),力度0-6映射到 speed 10-4(默认力度4对应 Pillow 默认的6)
+            kwargs = {'quality': quality, 'speed': 10 - effort}
+        else:
+            kwargs = {'quality': quality, 'optimize': True}
+        # 显式传入空的 icc_profile,否则 PNG/AVIF 会沿用原图的配置文件
+        kwargs['icc_profile'] = None
+        kwargs.update(self.metadata)
+        return kwargs
+    
+    def _reuses_probe_encode(self, format: str) -> bool:
+        """探测编码的结果能否直接作为最终输出(探测与最终编码参数一致)"""
+        return format not in ('WEBP', 'AVIF') or self.probe_effort == self.effort
+    
+    def _final_encode(self, img: Image.Image, quality: int, format: str):
+        """
+        以最终力度编码选定的质量
+        
+        不同力度下同一质量的大小可能偏大也可能偏小。偏离目标窗口时在最高(偏小时)或最低(偏大时)
+        质量补一次最终力度编码构成上下界,再用 _search_quality 插值搜索,通常共2-4次最终力度编码
+        
+        Returns:
+            (最终质量, 编码结果(缓冲区, 字节数))
+        """
+        target = self.target_size_bytes
+        kept = {}
+        measure = lambda quality: self._encode_candidate(img, quality, format, kept, final=True)
+        probes = {quality: measure(quality)}
+        if not self._in_target_window(probes[quality]):
+            bound = self.max_quality if probes[quality] <= target else self.min_quality
+            if bound != quality:
+                probes[bound] = measure(bound)
+            # 最高质量仍不超过目标或最低质量仍超过目标时没有可搜索的区间
+            if self._in_target_window(probes[bound]) or not min(probes.values()) <= target < max(probes.values()):
+                quality = bound
+            else:
+                quality = self._search_quality(measure, probes)
+        
+        encoded = kept.pop(quality, None)
+        for buffer, _ in kept.values():
+            _buffer_pool.release(buffer)
+        if encoded is None:
+            # 最低质量仍超过目标窗口,编码结果未被保留
+            buffer = _buffer_pool.acquire()
+            encoded = buffer, self._encode(img, quality, format, buffer, final=True)
+        return quality, encoded
+    
+    @staticmethod
+    def png_colors(quality: int) -> int:
+        """
+        PNG 质量对应的调色板颜色数,质量100表示不量化(无损)
+        
+        颜色数按 2^(1+7×质量/100) 取值(质量20约5色,50约23色,95约200色)。
+        调色板PNG的大小大致随每像素索引位数即 log(颜色数) 增长,
+        这样文件大小随质量近似线性变化,质量搜索的插值预测才准确
+        """
+        return max(2, min(256, round(2 ** (1 + 7 * quality / 100))))
+    
+    def _png_image(self, img: Image.Image, quality: int) -> Image.Image:
+        """按质量量化为调色板图片,透明通道随调色板保留"""
+        if quality >= 100 or img.mode == 'P':
+            return img
+        start = time.perf_counter()
+        colors = self.png_colors(quality)
+        if img.mode == 'RGBA':
+            # 只有 FASTOCTREE 支持带透明通道的量化,Pillow 对此也不做抖动
+            quantized = img.quantize(colors, method=Image.Quantize.FASTOCTREE)
+        else:
+            quantized = img.quantize(colors, method=Image.Quantize.MEDIANCUT)
+            if self.png_dither:
+                quantized = img.quantize(palette=quantized, dither=Image.Dither.FLOYDSTEINBERG)
+        self._record_stage('quantize', start, img.width * img.height)
+        return quantized
+    
+    def _encode(self, img: Image.Image, quality: int, format: str, buffer: io.BytesIO,
+                final: bool = False) -> int:
+        """
+        编码到缓冲区开头,返回编码字节数(缓冲区中超出该长度的内容是旧数据)
         
-        img.save(buffer, format=format, **save_kwargs)
+        final 为True时按最终编码的力度编码,计入 final 阶段
+        """
+        if format == 'PNG':
+            img = self._png_image(img, quality)
+        start = time.perf_counter()
+        buffer.seek(0)
+        img.save(buffer, format=format, **self._save_kwargs(quality, format, final=final))
+        self.encode_count += 1
         size = buffer.tell()
-        buffer.close()
+        self._record_stage('final' if final else 'probe', start, size)
         return size
     
+    def get_file_size(self, img: Image.Image, quality: int, format: str = 'JPEG', final: bool = False) -> int:
+        """获取指定质量下的图片文件大小"""
+        buffer = _buffer_pool.acquire()
+        try:
+            return self._encode(img, quality, format, buffer, final)
+        finally:
+            _buffer_pool.release(buffer)
+    
+    def _min_quality_size(self, img: Image.Image, format: str) -> int:
+        """
+        最低质量下最终写盘的编码大小,用于决定是否需要缩小
+        
+        探测力度低于最终力度时探测的大小偏大,按它决定缩小会把本可以只靠质量达标的图片缩小
+        """
+        return self.get_file_size(img, self.min_quality, format, final=not self._reuses_probe_encode(format))
+    
+    def predict_scale(self, img: Image.Image, original_size: int) -> float:
+        """
+        解码前根据尺寸和原文件大小预测需要的缩放比例
+        
+        只是按典型图片的估计,对平滑的图片会偏小;据此降采样解码后
+        要由 _reduce_confirmed 确认,避免缩小本可以只靠降低质量达标的图片
+        """
+        estimated_min_size = self._conservative_min_size(img, original_size)
+        if estimated_min_size <= self.target_size_bytes:
+            return 1.0
+        return (self.target_size_bytes / estimated_min_size) ** 0.5
+    
+    def _conservative_min_size(self, img: Image.Image, original_size: int) -> float:
+        """最低质量下编码大小的典型估计"""
+        return min(img.width * img.height * self.MIN_QUALITY_BYTES_PER_PIXEL,
+                   original_size * self.MIN_QUALITY_SIZE_RATIO)
+    
+    @classmethod
+    def _jpeg_size_factor(cls, quality: float) -> float:
+        """JPEG_SIZE_CURVE 上按 log(大小) 线性插值得到的相对大小"""
+        curve = cls.JPEG_SIZE_CURVE
+        if quality <= curve[0][0]:
+            return curve[0][1]
+        for (q0, f0), (q1, f1) in zip(curve, curve[1:]):
+            if quality <= q1:
+                return f0 * (f1 / f0) ** ((quality - q0) / (q1 - q0))
+        return curve[-1][1]
+    
+    def preclassify(self, img: Image.Image, original_size: int,
+                    output_format: str) -> Tuple[Optional[str], Optional[float]]:
+        """
+        只根据文件头(尺寸、文件大小、JPEG量化表)预测压缩结果,决定是否省去探测编码
+        
+        只对输出JPEG的文件分类,其他输出格式的大小-质量关系差异太大。
+        JPEG 原图按量化表估计原质量,再沿典型的大小-质量曲线推算各质量下的大小
+        
+        Returns:
+            ('skip', None): 原图就是JPEG且已不超过目标窗口,重新编码只会损失画质
+            ('resize', 预测的最低质量整图大小): 只降低质量预计达不到目标,确认后直接搜索尺寸
+            ('quality', 预测质量): 作为质量搜索的起点
+            (None, None): 无法判断,按常规流程搜索
+        """
+        if output_format != 'JPEG':
+            return None, None
+        
+        target = self.target_size_bytes
+        source_quality = estimate_jpeg_quality(getattr(img, 'quantization', None)) if img.format == 'JPEG' else None
+        if source_quality is None:
+            if self._conservative_min_size(img, original_size) > target * self.PRECLASSIFY_RESIZE_MARGIN:
+                return 'resize', self._conservative_min_size(img, original_size)
+            return None, None
+        
+        if original_size <= target * 1.05:
+            return 'skip', None
+        
+        source_factor = self._jpeg_size_factor(source_quality)
+        predicted_min_size = original_size * self._jpeg_size_factor(self.min_quality) / source_factor
+        if predicted_min_size > target * self.PRECLASSIFY_RESIZE_MARGIN:
+            return 'resize', predicted_min_size
+        if predicted_min_size > target:
+            return None, None
+        
+        # 在 [最低质量, 原质量] 内二分求预测大小等于目标的质量
+        low, high = self.min_quality, min(self.max_quality, source_quality)
+        while high - low > 1:
+            mid = (low + high) // 2
+            if original_size * self._jpeg_size_factor(mid) / source_factor <= target:
+                low = mid
+            else:
+                high = mid
+        return 'quality', low
+    
+    def reduce_on_load(self, img: Image.Image, original_size: int) -> Image.Image:
+        """
+        预测需要缩小到一半以下时,在解码阶段直接降低分辨率
+        
+        JPEG 用 draft 模式让解码器按 1/2、1/4、1/8 的DCT缩放直接解码,省去整图解码和内存;
+        其他格式解码后先用 reduce 整数倍快速缩小。降采样后的尺寸不小于预测的最终尺寸,
+        最终尺寸仍由后续的缩放搜索精确决定。预测未经确认,压缩时使用 _reduce_confirmed
+        """
+        return self._reduce_to_scale(img, self.predict_scale(img, original_size))
+    
+    def _reduce_confirmed(self, input_path: str, img: Image.Image, scale: float, checks: list,
+                          fallback_scale: float = 1.0):
+        """
+        按预测的比例降采样解码,再用一次最低质量编码确认降采样确有必要
+        
+        降采样后的图片在最低质量下仍超过目标时,更大的尺寸必然也超过,缩小不会损失可用的分辨率;
+        否则预测偏小,放弃降采样,重新打开文件按 fallback_scale 解码(该比例必须是确定需要的)。
+        流式读取的 TIFF 不回退到整幅解码,而是逐级减小缩小倍数重新流式读取(最小为2倍),
+        峰值内存始终有界;到最小倍数仍未确认时在该尺寸上搜索质量
+        
+        Args:
+            checks: [(目标字节数, 输出格式), ...],每一项都超出目标才算确认
+        
+        Returns:
+            (解码后的图片, 确认时各输出格式在最低质量下的编码大小 {格式: 字节数},否则为None)
+        """
+        def measure(image):
+            sizes = {}
+            for target, output_format in checks:
+                if output_format not in sizes:
+                    sizes[output_format] = self._min_quality_size(
+                        self._convert_for_format(image, output_format), output_format)
+                if sizes[output_format] <= target:
+                    return None
+            return sizes
+        
+        full_size = img.size
+        streamable = img.format == 'TIFF' and self._tiff_row_groups(img, 1) is not None
+        reduced = self._reduce_to_scale(img, scale)
+        if reduced.size == full_size:
+            return reduced, None
+        
+        sizes = measure(reduced)
+        if sizes:
+            return reduced, sizes
+        
+        if streamable:
+            factor = int(1 / scale)
+            while factor > max(2, int(1 / fallback_scale)):
+                factor -= 1
+                reduced.close()
+                with self.open_image(input_path) as source:
+                    reduced = self._stream_reduce_tiff(source, factor)
+                sizes = measure(reduced)
+                if sizes:
+                    return reduced, sizes
+            return reduced, None
+        
+        reduced.close()
+        return self._reduce_to_scale(self.open_image(input_path), fallback_scale), None
+    
+    def _reduce_to_scale(self, img: Image.Image, scale: float) -> Image.Image:
+        """
+        在解码阶段把图片降采样到不小于 scale 的比例,比例大于1/2时不处理
+        
+        超过解压炸弹上限而被 open_image 放行的 TIFF 只能流式读取,
+        不需要降采样或无法流式读取时在解码前报告原来的错误
+        """
+        if img.format == 'JPEG':
+            if scale <= 0.5:
+                img.draft(img.mode, (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+            return img
+        
+        factor = int(1 / scale) if scale <= 0.5 else 1
+        if factor >= 2 and img.format == 'TIFF':
+            reduced = self._stream_reduce_tiff(img, factor)
+            if reduced is not None:
+                img.close()
+                return reduced
+        if Image.MAX_IMAGE_PIXELS and img.width * img.height > 2 * Image.MAX_IMAGE_PIXELS:
+            img.close()
+            Image._decompression_bomb_check(img.size)
+        return img.reduce(factor) if factor >= 2 else img
+    
+    @staticmethod
+    def open_image(input_path: str) -> Image.Image:
+        """
+        打开图片(只读取文件头)
+        
+        超过 Pillow 解压炸弹像素上限的图片只有在是可流式读取的 TIFF 时才打开,
+        这类图片只有确实按区域解码并缩小时才会解码,见 _reduce_to_scale
+        """
+        try:
+            return Image.open(input_path)
+        except Image.DecompressionBombError as error:
+            limit = Image.MAX_IMAGE_PIXELS
+            Image.MAX_IMAGE_PIXELS = None
+            try:
+                img = Image.open(input_path, formats=['TIFF'])
+            except Exception:
+                raise error
+            finally:
+                Image.MAX_IMAGE_PIXELS = limit
+            if ImageCompressor._tiff_row_groups(img, 1) is None:
+                img.close()
+                raise error
+            return img
+    
+    @classmethod
+    def _tiff_row_groups(cls, img: Image.Image, max_rows: int):
+        """
+        把 TIFF 的条带/分块按所在的行分组,每组可以单独解码
+        
+        只支持像素交错存储的未压缩 TIFF,压缩的 TIFF 由 libtiff 整幅解码,无法按区域读取;
+        条带和分块再按 max_rows 行拆开,单条带的大图也能分区域读取
+        
+        Returns:
+            [(起始行, 结束行, [(解码器, 区域, 文件偏移, 字节数, 参数), ...]), ...],
+            不能流式读取时为None
+        """
+        if (img.format != 'TIFF' or img.use_load_libtiff or img._planar_configuration != 1
+                or img.mode not in cls.STREAM_MODES or not img.tile):
+            return None
+        tiled = 322 in img.tag_v2  # TileWidth
+        counts = img.tag_v2.get(325 if tiled else 279)  # TileByteCounts / StripByteCounts
+        if not counts or len(counts) < len(img.tile):
+            return None
+        # 整幅只有一个条带时 Pillow 只保留最后一个偏移
+        counts = counts[-len(img.tile):]
+        
+        groups = {}
+        for (codec, (x0, y0, x1, y1), offset, args), nbytes in zip((tile[:4] for tile in img.tile), counts):
+            if codec != 'raw':
+                return None
+            if y1 - y0 > max_rows:
+                # 分块在最后一行也存有完整的 TileLength 行
+                row_bytes = nbytes // (img.tag_v2[323] if tiled else y1 - y0)
+                for top in range(y0, y1, max_rows):
+                    bottom = min(top + max_rows, y1)
+                    groups.setdefault((top, bottom), []).append(
+                        (codec, (x0, top, x1, bottom), offset + (top - y0) * row_bytes,
+                         (bottom - top) * row_bytes, args))
+            else:
+                groups.setdefault((y0, y1), []).append((codec, (x0, y0, x1, y1), offset, nbytes, args))
+        
+        rows = sorted(groups)
+        if rows[0][0] != 0 or rows[-1][1] != img.height or any(
+                previous[1] != current[0] for previous, current in zip(rows, rows[1:])):
+            return None
+        return [(y0, y1, groups[(y0, y1)]) for y0, y1 in rows]
+    
+    @staticmethod
+    def _decode_tiff_region(img: Image.Image, tiles: list, top: int, bottom: int) -> Image.Image:
+        """只解码 [top, bottom) 行内的条带/分块"""
+        region = Image.core.new(img.mode, (img.width, bottom - top))
+        for codec, (x0, y0, x1, y1), offset, nbytes, args in tiles:
+            decoder = Image._getdecoder(img.mode, codec, args, img.decoderconfig)
+            try:
+                decoder.setimage(region, (x0, y0 - top, x1, y1 - top))
+                img.fp.seek(offset)
+                consumed, error = decoder.decode(img.fp.read(nbytes))
+            finally:
+                decoder.cleanup()
+            if error < 0 or consumed >= 0:
+                raise OSError('TIFF 图像数据不完整或已损坏')
+        return img._new(region)
+    
+    def _stream_reduce_tiff(self, img: Image.Image, factor: int) -> Optional[Image.Image]:
+        """
+        按区域流式读取 TIFF,边读边按整数倍 reduce 缩小
+        
+        每次只解码约 STREAM_REGION_BYTES 的行,峰值内存约为一个区域加缩小后的整图,
+        与原图大小无关。区域边界对齐到 factor 行,结果与整图解码后 reduce 完全相同
+        
+        Returns:
+            缩小后的图片,不能流式读取时为None
+        """
+        width, height = img.size
+        row_limit = max(factor, self.STREAM_REGION_BYTES // (width * 4) // factor * factor)
+        groups = self._tiff_row_groups(img, row_limit)
+        if groups is None:
+            return None
+        
+        reduced = Image.new(img.mode, (-(-width // factor), -(-height // factor)))
+        reduced.info = img.info.copy()
+        # 上一区域末尾不足 factor 行的部分,和下一区域一起缩小
+        carry = None
+        top = 0
+        out_y = 0
+        tiles = []
+        for index, (_, bottom, group) in enumerate(groups):
+            tiles.extend(group)
+            last = index == len(groups) - 1
+            if bottom - top < row_limit and not last:
+                continue
+            
+            region = self._decode_tiff_region(img, tiles, top, bottom)
+            if carry is not None:
+                merged = Image.new(img.mode, (width, carry.height + region.height))
+                merged.paste(carry, (0, 0))
+                merged.paste(region, (0, carry.height))
+                region = merged
+            usable = region.height if last else region.height // factor * factor
+            if usable:
+                part = region if usable == region.height else region.crop((0, 0, width, usable))
+                part = part.reduce(factor)
+                reduced.paste(part, (0, out_y))
+                out_y += part.height
+            carry = region.crop((0, usable, width, region.height)) if usable < region.height else None
+            top = bottom
+            tiles = []
+        
+        # 与 Pillow 整图加载 TIFF 时一样应用 EXIF 方向
+        orientation = img.getexif().get(ExifTags.Base.Orientation, 1)
+        if orientation != 1:
+            reduced.getexif()[ExifTags.Base.Orientation] = orientation
+            ImageOps.exif_transpose(reduced, in_place=True)
+        return reduced
+    
+    def make_proxy(self, img: Image.Image, grid: int = 4) -> Image.Image:
+        """
+        从整图中均匀抽取 grid×grid 个原分辨率分块拼成代理图
+        
+        分块保持原始细节密度,因此代理图的每像素字节数可以外推到整图;
+        分块边长对齐到16像素,避免拼缝处的JPEG宏块额外开销
+        """
+        tile = int((self.proxy_pixels / (grid * grid)) ** 0.5) // 16 * 16
+        tile = max(16, min(tile, img.width // grid // 16 * 16, img.height // grid // 16 * 16))
+        proxy = Image.new(img.mode, (tile * grid, tile * grid))
+        
+        cell_w, cell_h = img.width / grid, img.height / grid
+        for row in range(grid):
+            for col in range(grid):
+                left = int(col * cell_w + (cell_w - tile) / 2)
+                top = int(row * cell_h + (cell_h - tile) / 2)
+                proxy.paste(img.crop((left, top, left + tile, top + tile)), (col * tile, row * tile))
+        
+        return proxy
+    
     def compress_image(self, img: Image.Image, output_format: str = 'JPEG') -> Tuple[Image.Image, int]:
         """压缩图片到目标大小"""
+        img, quality, _, encoded = self._compress_image(img, output_format)
+        if encoded:
+            _buffer_pool.release(encoded[0])
+        if output_format == 'PNG':
+            img = self._png_image(img, quality)
+        return img, quality
+    
+    def _convert_for_format(self, img: Image.Image, output_format: str) -> Image.Image:
+        """把图片转换为输出格式支持的颜色模式"""
+        original, start = img, time.perf_counter()
         if output_format == 'JPEG' and img.mode in ('RGBA', 'LA', 'P'):
             background = Image.new('RGB', img.size, (255, 255, 255))
             if img.mode == 'P':
                 img = img.convert('RGBA')
             background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
             img = background
-        elif img.mode not in ('RGB', 'L'):
+        elif output_format in self.ALPHA_FORMATS and img.mode not in ('RGB', 'L', 'RGBA'):
+            # 保留透明通道;调色板等其他模式先展开(PNG 再按质量重新量化)
+            has_alpha = 'A' in img.getbands() or 'transparency' in img.info
+            img = img.convert('RGBA' if has_alpha else 'RGB')
+        elif output_format not in self.ALPHA_FORMATS and img.mode not in ('RGB', 'L'):
             img = img.convert('RGB')
+        if img is not original:
+            self._record_stage('convert', start, img.width * img.height * len(img.getbands()))
+        return img
+    
+    def _compress_image(self, img: Image.Image, output_format: str, quality_hint: Optional[int] = None,
+                        resize_from: Optional[float] = None):
+        """
+        压缩图片到目标大小
+        
+        Args:
+            quality_hint: 预计的最佳质量(如缓存中上次的结果),会最先探测
+            resize_from: 最低质量下最终写盘的编码大小(已超过目标);给出时跳过质量探测,直接搜索尺寸
+        
+        Returns:
+            (图片, 质量, 代理模式下预测的整图大小或None, 选中质量的编码结果或None)。
+            编码结果为 (缓冲区, 字节数),缓冲区来自缓冲区池,用完后需归还
+        """
+        img = self._convert_for_format(img, output_format)
+        
+        if resize_from is not None:
+            img, quality, encoded = self._search_dimensions(img, output_format, resize_from)
+            return img, quality, None, encoded
         
         low, high = self.min_quality, self.max_quality
-        best_quality = high
         
-        size_at_max = self.get_file_size(img, high, output_format)
-        if size_at_max <= self.target_size_bytes:
-            return img, high
+        # 整图探测时保留当前最佳候选的编码结果,写盘时不再重新编码
+        kept = {}
+        
+        if self.probe_mode == 'proxy' and img.width * img.height > self.proxy_pixels * 2:
+            start = time.perf_counter()
+            proxy = self.make_proxy(img)
+            self._record_stage('proxy', start, proxy.width * proxy.height * len(proxy.getbands()))
+            scale = img.width * img.height / (proxy.width * proxy.height)
+            # 元数据的大小是固定开销,不随像素数外推
+            overhead = sum(len(value) for value in self.metadata.values())
+            measure = lambda quality: int(
+                (self.get_file_size(proxy, quality, output_format) - overhead) * scale) + overhead
+        else:
+            measure = lambda quality: self._encode_candidate(img, quality, output_format, kept)
+            scale = None
+        
+        probes = {}
+        # PNG 先尝试无损编码(质量100),已满足目标时不做量化
+        if output_format == 'PNG' and high < 100:
+            probes[100] = measure(100)
+            if probes[100] <= self.target_size_bytes * 1.05:
+                return img, 100, probes[100] if scale else None, kept.get(100)
+        
+        if quality_hint is not None and low < quality_hint < high:
+            probes[quality_hint] = measure(quality_hint)
+            if self._in_target_window(probes[quality_hint]):
+                return img, quality_hint, probes[quality_hint] if scale else None, kept.get(quality_hint)
+        
+        # 提示质量已超过目标时,最高质量必然也超过,不必探测
+        if quality_hint not in probes or probes[quality_hint] <= self.target_size_bytes:
+            probes[high] = measure(high)
+            if probes[high] <= self.target_size_bytes:
+                return img, high, probes[high] if scale else None, kept.get(high)
+        
+        # 提示质量已不超过目标时,它就是搜索下界,不必再探测最低质量
+        if all(size > self.target_size_bytes for size in probes.values()):
+            size_at_min = probes[low] = measure(low)
+            if size_at_min > self.target_size_bytes:
+                for buffer, _ in kept.values():
+                    _buffer_pool.release(buffer)
+                if not self._reuses_probe_encode(output_format):
+                    # 缩小前按最终力度确认;最终力度下最低质量已达标时由 _final_encode 搜索质量
+                    size_at_min = self._min_quality_size(img, output_format)
+                    if size_at_min <= self.target_size_bytes:
+                        return img, low, None, None
+                img, quality, encoded = self._search_dimensions(img, output_format, size_at_min)
+                return img, quality, None, encoded
+        
+        best_quality = self._search_quality(measure, probes)
+        
+        encoded = kept.pop(best_quality, None)
+        for buffer, _ in kept.values():
+            _buffer_pool.release(buffer)
+        return img, best_quality, probes[best_quality] if scale else None, encoded
+    
+    def _encode_candidate(self, img: Image.Image, quality: int, format: str, kept: dict,
+                          final: bool = False) -> int:
+        """
+        探测编码并保留可能成为最终结果的编码
         
-        size_at_min = self.get_file_size(img, low, output_format)
-        if size_at_min > self.target_size_bytes:
-            scale_factor = (self.target_size_bytes / size_at_min) ** 0.5
-            new_size = (int(img.width * scale_factor), int(img.height * scale_factor))
-            img = img.resize(new_size, Image.Resampling.LANCZOS)
-            return img, low
+        搜索最终选中的总是不超过目标窗口上限的最高质量,
+        因此只需保留满足该条件且质量最高的一份,其余缓冲区立即归还
+        """
+        buffer = _buffer_pool.acquire()
+        size = self._encode(img, quality, format, buffer, final)
+        
+        if size <= self.target_size_bytes * 1.05 and all(quality > q for q in kept):
+            for old_buffer, _ in kept.values():
+                _buffer_pool.release(old_buffer)
+            kept.clear()
+            kept[quality] = (buffer, size)
+        else:
+            _buffer_pool.release(buffer)
         
-        while low <= high:
-            mid = (low + high) // 2
-            current_size = self.get_file_size(img, mid, output_format)
+        return size
+    
+    def _resize(self, img: Image.Image, scale: float) -> Image.Image:
+        """按比例缩放,大倍率缩小时先做整数倍快速缩小再 LANCZOS"""
+        start = time.perf_counter()
+        new_size = (max(1, int(img.width * scale)), max(1, int(img.height * scale)))
+        resized = img.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        self._record_stage('resize', start, new_size[0] * new_size[1] * len(img.getbands()))
+        return resized
+    
+    def _search_dimensions(self, img: Image.Image, output_format: str, size_at_min: int):
+        """
+        最低质量仍超过目标时,联合搜索尺寸和质量
+        
+        先求最低质量下不超过目标的最大尺寸;再在略小的尺寸上(默认为其85%)搜索质量,
+        若能换来明显更高的质量则采用后者(该尺寸上最高和最低质量的大小相同时说明质量不起作用,
+        不交换)。两种结果都经过实际编码验证
+        
+        Returns:
+            (缩放后的图片, 质量, 编码结果(缓冲区, 字节数))
+        """
+        low, high = self.min_quality, self.max_quality
+        start_scale = min(1.0, (self.target_size_bytes / size_at_min) ** 0.5)
+        scale, resized, encoded = self._fit_scale(img, low, output_format, start_scale, size_at_min)
+        
+        smaller_scale = scale * self.RESIZE_MIN_DIMENSION_RATIO
+        if high <= low or smaller_scale >= scale:
+            return resized, low, encoded
+        
+        smaller = self._resize(img, smaller_scale)
+        kept = {}
+        measure = lambda quality: self._encode_candidate(smaller, quality, output_format, kept)
+        probes = {high: measure(high), low: measure(low)}
+        if probes[high] <= self.target_size_bytes:
+            quality = high
+        else:
+            quality = self._search_quality(measure, probes) if probes[low] <= self.target_size_bytes else low
+        
+        # 质量不影响大小的格式(BMP、未压缩的TIFF等)换不来画质,不做交换
+        if (quality - low >= self.RESIZE_MIN_QUALITY_GAIN and quality in kept
+                and probes[low] != probes[high]):
+            _buffer_pool.release(encoded[0])
+            return smaller, quality, kept.pop(quality)
+        
+        for buffer, _ in kept.values():
+            _buffer_pool.release(buffer)
+        return resized, low, encoded
+    
+    def _fit_scale(self, img: Image.Image, quality: int, output_format: str, scale: float, full_size: int):
+        """
+        在给定质量下寻找编码后不超过目标的最大缩放比例
+        
+        按 大小 ∝ 比例^k 外推下一次尝试的比例,k 由最近两次编码结果估计
+        (初始为2,即大小与像素数成正比),并始终落在已知可行与不可行的比例之间
+        
+        Returns:
+            (比例, 缩放后的图片, 编码结果(缓冲区, 字节数))
+        """
+        target = self.target_size_bytes
+        points = [(1.0, full_size)]
+        best = None
+        too_large = 1.0
+        
+        for _ in range(self.MAX_SCALE_STEPS):
+            resized = self._resize(img, scale)
+            buffer = _buffer_pool.acquire()
+            size = self._encode(resized, quality, output_format, buffer)
+            points.append((scale, size))
+            
+            if size <= target * 1.05:
+                if best:
+                    _buffer_pool.release(best[2][0])
+                best = (scale, resized, (buffer, size))
+                if self._in_target_window(size):
+                    break
+            else:
+                _buffer_pool.release(buffer)
+                too_large = min(too_large, scale)
             
-            if self.target_size_bytes * 0.95 <= current_size <= self.target_size_bytes * 1.05:
-                best_quality = mid
+            (scale_a, size_a), (scale_b, size_b) = points[-2:]
+            exponent = 2.0
+            if scale_a != scale_b and size_a != size_b:
+                exponent = min(max(math.log(size_a / size_b) / math.log(scale_a / scale_b), 1.0), 3.0)
+            next_scale = scale_b * (target / size_b) ** (1 / exponent)
+            
+            lower_bound = best[0] if best else 0.0
+            if not lower_bound < next_scale < too_large:
+                next_scale = (lower_bound + too_large) / 2 if best else scale * 0.7
+            if abs(next_scale - scale) * max(img.size) < 1:
                 break
-            elif current_size > self.target_size_bytes:
-                high = mid - 1
-                best_quality = mid
+            scale = next_scale
+        
+        # 预测持续偏大时继续按比例缩小,直到满足目标
+        while best is None:
+            scale *= 0.7
+            resized = self._resize(img, scale)
+            buffer = _buffer_pool.acquire()
+            size = self._encode(resized, quality, output_format, buffer)
+            if size <= target * 1.05 or min(resized.size) <= 16:
+                best = (scale, resized, (buffer, size))
+            else:
+                _buffer_pool.release(buffer)
+        
+        return best
+    
+    def _in_target_window(self, size: int) -> bool:
+        """文件大小是否落在目标大小±5%窗口内"""
+        return self.target_size_bytes * 0.95 <= size <= self.target_size_bytes * 1.05
+    
+    def _search_quality(self, measure, probes: dict) -> int:
+        """
+        基于大小-质量模型预测最佳质量
+        
+        在已探测的上下界之间按 log(文件大小) 对质量线性插值,预测命中目标的质量,
+        编码确认后收缩区间。通常1-2次确认编码即可落入目标±5%窗口;
+        同一侧连续收缩时改用二分,保证最坏情况下也能收敛
+        
+        Args:
+            measure: 返回指定质量下(预测)文件大小的函数
+            probes: 已探测的 {质量: 文件大小},至少包含一个不超过目标和一个超过目标的质量
+        """
+        target = self.target_size_bytes
+        lower = max(q for q, size in probes.items() if size <= target)
+        upper = min(q for q, size in probes.items() if size > target)
+        last_side = None
+        stalled = False
+        
+        while upper - lower > 1 and not self._in_target_window(probes[lower]):
+            if stalled:
+                quality = (lower + upper) // 2
             else:
-                low = mid + 1
-                if current_size <= self.target_size_bytes:
-                    best_quality = mid
+                log_low, log_high = math.log(probes[lower]), math.log(probes[upper])
+                ratio = (math.log(target) - log_low) / (log_high - log_low) if log_high > log_low else 0.5
+                quality = round(lower + ratio * (upper - lower))
+                quality = min(max(quality, lower + 1), upper - 1)
+            
+            size = measure(quality)
+            probes[quality] = size
+            
+            if size <= target:
+                side, lower = 'low', quality
+            elif self._in_target_window(size):
+                return quality
+            else:
+                side, upper = 'high', quality
+            
+            stalled = side == last_side
+            last_side = side
         
-        return img, best_quality
+        return lower
     
     def compress_file(self, input_path: str, output_path: Optional[str] = None, 
-                     output_format: Optional[str] = None) -> dict:
+                     output_format: Optional[str] = None,
+                     quality_hint: Optional[int] = None) -> CompressionResult:
         """压缩单个图片文件"""
         try:
             original_size = os.path.getsize(input_path)
             
             # 检查是否需要压缩
             if original_size <= self.threshold_bytes:
-                return {
-                    'success': True,
-                    'skipped': True,
-                    'input_path': input_path,
-                    'output_path': output_path or input_path,
-                    'original_size': original_size,
-                    'compressed_size': original_size,
-                    'compression_ratio': 0,
-                    'quality': 100,
-                    'message': f'文件大小 {original_size/1024:.1f}KB 未超过阈值 {self.threshold_kb}KB，跳过'
-                }
-            
-            img = Image.open(input_path)
+                return self._threshold_skip_result(input_path, output_path, original_size)
             
+            encodes_before = self.encode_count
+            self.timings = {} if self.profile else None
+            start = time.perf_counter()
+            img = self.open_image(input_path)
+            
+            source_format = img.format
             if output_format is None:
-                output_format = img.format if img.format else 'JPEG'
+                output_format = source_format if source_format else 'JPEG'
+            guarded = self.size_guard and output_format == source_format
+            
+            action, predicted = self.preclassify(img, original_size, output_format)
+            if action == 'skip' or (guarded and original_size <= self.target_size_bytes * 1.05):
+                img.close()
+                return self._keep_original_result(
+                    input_path, output_path, original_size,
+                    f'文件大小 {original_size/1024:.1f}KB 已在目标 {self.target_size_kb}KB 的允许范围内，保留原文件')
+            if action == 'quality' and quality_hint is None:
+                quality_hint = predicted
+            
+            img, confirmed = self._reduce_confirmed(
+                input_path, img, self.predict_scale(img, original_size),
+                [(self.target_size_bytes, output_format)])
+            if self.timings is not None:
+                # 打开图片是惰性的,在这里显式解码才能单独计时
+                img.load()
+                self._record_stage('decode', start, original_size)
+            img = self._orient_and_collect_metadata(img)
             
             if output_path is None:
                 output_path = input_path
             
-            compressed_img, quality = self.compress_image(img, output_format)
+            # 降采样已确认时最低质量的大小是实测的;预分类的结论只是按曲线预测,
+            # 先用一次最低质量编码确认只降质量确实达不到目标,否则按常规流程搜索质量
+            resize_from = None
+            if confirmed:
+                resize_from = confirmed[output_format]
+            elif action == 'resize':
+                size_at_min = self._min_quality_size(self._convert_for_format(img, output_format), output_format)
+                if size_at_min > self.target_size_bytes:
+                    resize_from = size_at_min
+            compressed_img, quality, predicted_size, encoded = self._compress_image(
+                img, output_format, quality_hint, resize_from)
+            if not self._reuses_probe_encode(output_format):
+                if encoded:
+                    _buffer_pool.release(encoded[0])
+                quality, encoded = self._final_encode(compressed_img, quality, output_format)
             
-            save_kwargs = {'quality': quality, 'optimize': True}
+            if guarded:
+                # 写盘前先拿到最终编码结果,不比原文件小就不写
+                if not encoded:
+                    buffer = _buffer_pool.acquire()
+                    encoded = buffer, self._encode(compressed_img, quality, output_format, buffer)
+                if encoded[1] >= original_size:
+                    _buffer_pool.release(encoded[0])
+                    return self._keep_original_result(
+                        input_path, output_path, original_size,
+                        f'重新编码为 {encoded[1]/1024:.1f}KB (质量 {quality}) 不小于原文件 '
+                        f'{original_size/1024:.1f}KB，保留原文件',
+                        encodes=self.encode_count - encodes_before)
+            
+            return self._write_compressed(input_path, output_path, original_size, output_format,
+                                          compressed_img, quality, predicted_size, encoded, encodes_before)
+        
+        except Exception as e:
+            return self._error_result(input_path, e)
+        finally:
+            self.timings = None
+            self.metadata = {}
+    
+    def _write_compressed(self, input_path: str, output_path: str, original_size: int, output_format: str,
+                          compressed_img: Image.Image, quality: int, predicted_size: Optional[int],
+                          encoded, encodes_before: int) -> CompressionResult:
+        """写出选定的编码结果(没有现成的编码结果时重新编码)并构造压缩结果"""
+        start = time.perf_counter()
+        if encoded:
+            buffer, size = encoded
+            try:
+                with buffer.getbuffer() as view:
+                    write_atomic(output_path, lambda f: f.write(view[:size]))
+            finally:
+                _buffer_pool.release(buffer)
+        else:
             if output_format == 'PNG':
-                compress_level = int((100 - quality) / 100 * 9)
-                save_kwargs = {'compress_level': compress_level, 'optimize': True}
-            
-            compressed_img.save(output_path, format=output_format, **save_kwargs)
-            compressed_size = os.path.getsize(output_path)
-            
-            return {
-                'success': True,
-                'skipped': False,
-                'input_path': input_path,
-                'output_path': output_path,
-                'original_size': original_size,
-                'compressed_size': compressed_size,
-                'compression_ratio': (1 - compressed_size / original_size) * 100,
-                'quality': quality,
-                'message': f'{original_size/1024:.1f}KB → {compressed_size/1024:.1f}KB (压缩 {(1 - compressed_size / original_size) * 100:.1f}%, 质量 {quality})'
-            }
+                compressed_img = self._png_image(compressed_img, quality)
+            write_atomic(output_path, lambda f: compressed_img.save(
+                f, format=output_format, **self._save_kwargs(quality, output_format)))
+            self.encode_count += 1
+        compressed_size = os.path.getsize(output_path)
+        self._record_stage('save', start, compressed_size)
+        
+        quality_text = f'质量 {quality}'
+        if output_format == 'PNG':
+            quality_text += ', 无损' if quality >= 100 else f', {self.png_colors(quality)}色'
+        
+        return CompressionResult(
+            success=True,
+            input_path=input_path,
+            output_path=output_path,
+            original_size=original_size,
+            compressed_size=compressed_size,
+            quality=quality,
+            predicted_size=predicted_size,
+            encodes=self.encode_count - encodes_before,
+            timings={
+                stage: {'seconds': seconds, 'bytes': nbytes, 'calls': calls}
+                for stage, (seconds, nbytes, calls) in self.timings.items()
+            } if self.timings is not None else None,
+            message=f'{original_size/1024:.1f}KB → {compressed_size/1024:.1f}KB (压缩 {(1 - compressed_size / original_size) * 100:.1f}%, {quality_text})'
+        )
+    
+    def _set_target(self, target_kb: float):
+        """设置当前的目标大小"""
+        self.target_size_kb = target_kb
+        self.target_size_bytes = target_kb * 1024
+    
+    @staticmethod
+    def rendition_path(path: str, rendition: Rendition, output_format: Optional[str] = None) -> str:
+        """规格的输出路径:在文件名后加 _规格名,指定格式时换用对应扩展名"""
+        base, ext = os.path.splitext(path)
+        if output_format:
+            ext = format_extension(output_format)
+        return f'{base}_{rendition.name}{ext}'
+    
+    def compress_renditions(self, input_path: str, renditions: List[Rendition],
+                            output_path: Optional[str] = None,
+                            output_format: Optional[str] = None) -> List[CompressionResult]:
+        """
+        解码一次,按多种规格输出(如缩略图、预览图和原尺寸图)
+        
+        解码时只降采样到各规格中所需分辨率最高的一种;之后按最长边从大到小处理,
+        每种规格从已缩放出的、不小于其最长边的最小图片继续缩放,缩放结果共享给更小的规格。
+        每种规格按自己的目标大小单独搜索质量,不使用阈值
+        
+        Args:
+            output_path: 输出路径的基准,各规格在文件名后加 _规格名,默认为原文件路径
+            output_format: 规格未指定格式时的输出格式,默认与原图相同
+        
+        Returns:
+            每种规格一个结果,顺序与 renditions 相同
+        """
+        base_path = output_path or input_path
+        results = [None] * len(renditions)
+        target_kb = self.target_size_kb
+        try:
+            original_size = os.path.getsize(input_path)
+            self.timings = {} if self.profile else None
+            start = time.perf_counter()
+            img = self.open_image(input_path)
+            source_format = img.format
+            
+            longest = max(img.size)
+            scale = dim_scale = 0
+            for rendition in renditions:
+                self._set_target(rendition.target_kb)
+                limit = min(1, rendition.max_dimension / longest) if rendition.max_dimension else 1
+                scale = max(scale, min(self.predict_scale(img, original_size), limit))
+                dim_scale = max(dim_scale, limit)
+            self._set_target(target_kb)
+            
+            # 降采样只需对分辨率会受影响的规格确认;未确认时只按最长边限制降采样
+            checks = [(rendition.target_kb * 1024,
+                       rendition.format or output_format or source_format or 'JPEG')
+                      for rendition in renditions
+                      if not rendition.max_dimension or rendition.max_dimension / longest > scale]
+            img, _ = self._reduce_confirmed(input_path, img, scale, checks, dim_scale)
+            if self.timings is not None:
+                img.load()
+                self._record_stage('decode', start, original_size)
+            img = self._orient_and_collect_metadata(img)
+            
+            # 缩放金字塔:已得到的各级图片,第一级是解码结果
+            levels = [img]
+            order = sorted(range(len(renditions)),
+                           key=lambda index: -(renditions[index].max_dimension or math.inf))
+            for index in order:
+                rendition = renditions[index]
+                format = rendition.format or output_format or source_format or 'JPEG'
+                encodes_before = self.encode_count
+                try:
+                    source = levels[0]
+                    if rendition.max_dimension:
+                        larger = [level for level in levels if max(level.size) >= rendition.max_dimension]
+                        if larger:
+                            source = min(larger, key=lambda level: level.width * level.height)
+                        if max(source.size) > rendition.max_dimension:
+                            source = self._resize(source, rendition.max_dimension / max(source.size))
+                            levels.append(source)
+                    
+                    self._set_target(rendition.target_kb)
+                    compressed_img, quality, predicted_size, encoded = self._compress_image(source, format)
+                    if not self._reuses_probe_encode(format):
+                        if encoded:
+                            _buffer_pool.release(encoded[0])
+                        quality, encoded = self._final_encode(compressed_img, quality, format)
+                    result = self._write_compressed(
+                        input_path, self.rendition_path(base_path, rendition, rendition.format or output_format),
+                        original_size, format, compressed_img, quality, predicted_size, encoded, encodes_before)
+                except Exception as e:
+                    result = self._error_result(input_path, e)
+                finally:
+                    self._set_target(target_kb)
+                result.rendition = rendition.name
+                result.message = f'[{rendition.name}] {result.message}'
+                results[index] = result
+                # 解码耗时只计入第一个结果
+                self.timings = {} if self.profile else None
         
         except Exception as e:
-            return {
-                'success': False,
-                'skipped': False,
-                'input_path': input_path,
-                'error': str(e),
-                'message': f'错误: {str(e)}'
-            }
+            for index, rendition in enumerate(renditions):
+                if results[index] is None:
+                    results[index] = self._error_result(input_path, e)
+                    results[index].rendition = rendition.name
+        finally:
+            self.timings = None
+            self.metadata = {}
+        return results
+    
+    def _threshold_skip_result(self, input_path: str, output_path: Optional[str],
+                               original_size: int) -> CompressionResult:
+        """构造未超过阈值而跳过的结果"""
+        return CompressionResult(
+            success=True,
+            skipped=True,
+            input_path=input_path,
+            output_path=output_path or input_path,
+            original_size=original_size,
+            compressed_size=original_size,
+            quality=100,
+            message=f'文件大小 {original_size/1024:.1f}KB 未超过阈值 {self.threshold_kb}KB，跳过'
+        )
+    
+    def _orient_and_collect_metadata(self, img: Image.Image) -> Image.Image:
+        """
+        按需应用 EXIF 方向,并记录写盘时要保留的元数据
+        
+        在唯一一次解码之后进行,输出无需再由其他工具打开旋转或补写元数据
+        """
+        if not (self.auto_orient or self.keep_metadata):
+            return img
+        
+        exif = img.getexif()
+        if self.auto_orient and exif.get(ExifTags.Base.Orientation, 1) != 1:
+            start = time.perf_counter()
+            # exif_transpose 同时从返回图像的 EXIF 中移除方向标记
+            img = ImageOps.exif_transpose(img)
+            exif = img.getexif()
+            self._record_stage('orient', start, img.width * img.height * len(img.getbands()))
+        
+        if self.keep_metadata:
+            if exif:
+                self.metadata['exif'] = exif.tobytes()
+            icc_profile = img.info.get('icc_profile')
+            # CMYK 图像总会被转换为 RGB,原来的 CMYK 配置文件不再适用
+            if icc_profile and img.mode != 'CMYK':
+                self.metadata['icc_profile'] = icc_profile
+        return img
+    
+    def _keep_original_result(self, input_path: str, output_path: Optional[str], original_size: int,
+                              message: str, encodes: Optional[int] = None) -> CompressionResult:
+        """
+        重新编码不划算时保留原文件
+        
+        覆盖原文件时不写任何数据;输出到其他位置时把原文件原样复制过去
+        """
+        if output_path and os.path.abspath(output_path) != os.path.abspath(input_path):
+            self._copy_output(input_path, output_path, link=False)
+        return CompressionResult(
+            success=True,
+            skipped=True,
+            kept_original=True,
+            input_path=input_path,
+            output_path=output_path or input_path,
+            original_size=original_size,
+            compressed_size=original_size,
+            encodes=encodes,
+            timings={
+                stage: {'seconds': seconds, 'bytes': nbytes, 'calls': calls}
+                for stage, (seconds, nbytes, calls) in self.timings.items()
+            } if self.timings is not None else None,
+            message=message
+        )
+    
+    @staticmethod
+    def _error_result(input_path: str, error: Exception) -> CompressionResult:
+        """构造失败结果"""
+        return CompressionResult(
+            success=False,
+            input_path=input_path,
+            error=str(error),
+            message=f'错误: {str(error)}'
+        )
+    
+    def _output_file_for(self, file_path: Path, input_path: Path, output_path: Optional[Path],
+                         output_format: Optional[str], created_dirs: Optional[set] = None) -> str:
+        """计算输入文件对应的输出路径"""
+        if not output_path:
+            return str(file_path)
+        
+        relative_path = file_path.relative_to(input_path)
+        out_file = output_path / relative_path
+        if created_dirs is None or out_file.parent not in created_dirs:
+            out_file.parent.mkdir(parents=True, exist_ok=True)
+            if created_dirs is not None:
+                created_dirs.add(out_file.parent)
+        
+        if output_format:
+            out_file = out_file.with_suffix(format_extension(output_format))
+        
+        return str(out_file)
     
     def compress_folder(self, input_folder: str, output_folder: Optional[str] = None,
                        recursive: bool = True, output_format: Optional[str] = None,
-                       progress_callback=None) -> List[dict]:
-        """批量压缩文件夹内的图片"""
+                       progress_callback=None, workers: Optional[int] = None,
+                       estimate_total: bool = False,
+                       result_log: Optional[str] = None,
+                       journal_path: Optional[str] = None,
+                       resume: bool = False,
+                       memory_budget_mb: Optional[float] = None,
+                       dedup: bool = False, dedup_link: bool = False,
+                       renditions: Optional[List[Rendition]] = None) -> CompressionSummary:
+        """
+        批量压缩文件夹内的图片
+        
+        文件边遍历边处理:未超过阈值和缓存命中的文件在遍历时直接报告,其余文件立即送入压缩。
+        progress_callback 收到的总数是目前已发现的文件数,遍历结束后才是准确值
+        
+        Args:
+            workers: 并行进程数,默认为CPU核心数;为1时在当前进程内逐个处理。
+                并行时结果按完成顺序回调,progress_callback 抛出异常即取消剩余任务
+            estimate_total: 是否在后台线程中预先统计文件总数,使进度条总数尽早接近准确值
+            result_log: 结果日志路径(.jsonl 或 .csv),每个文件处理完立即写入
+            journal_path: 断点日志路径,记录已完成的文件;任务完整结束后自动删除
+            resume: 是否读取已有的断点日志,跳过上次已完成的文件
+            memory_budget_mb: 并行时同时在途任务的预计解码内存上限(MB),为None时不限制。
+                超过整个预算的大图在其他任务全部完成后单独运行
+            dedup: 内容相同的文件只压缩第一个,其余直接复用它的输出
+            dedup_link: 复用输出时使用硬链接(不支持时退回复制)
+            renditions: 多规格输出,每个文件解码一次生成每种规格(见 compress_renditions)。
+                必须指定输出文件夹;不使用阈值、缓存和去重,每种规格各报告一个结果
+        
+        Returns:
+            运行汇总。每个文件的结果只经过 progress_callback 和结果日志,不在内存中累积
+        """
         input_path = Path(input_folder)
         if not input_path.exists():
             raise ValueError(f"输入文件夹不存在: {input_folder}")
+        if renditions and not output_folder:
+            raise ValueError("多规格输出必须指定输出文件夹")
+        if renditions and dedup:
+            raise ValueError("多规格输出不支持去重")
         
         if output_folder:
             output_path = Path(output_folder)
@@ -166,43 +2045,449 @@ class ImageCompressor:
         else:
             output_path = None
         
-        results = []
-        pattern = '**/*' if recursive else '*'
+        summary = CompressionSummary()
+        settings = self.settings_key(output_format)
+        journal = None
+        if journal_path:
+            job_key = f'{settings}|target={self.target_size_kb}|output={output_folder or ""}'
+            journal = JobJournal(journal_path, job_key, resume)
+        log = ResultLog(result_log) if result_log else None
+        created_dirs = set()
+        
+        if workers is None:
+            workers = os.cpu_count() or 1
+        
+        estimator = FileCountEstimator(input_folder, recursive, self.SUPPORTED_FORMATS) if estimate_total else None
+        duplicates = DuplicateTracker(eager=output_path is None) if dedup else None
+        discovered = 0
+        index = 0
+        
+        def total_files():
+            if estimator is None:
+                return discovered
+            return estimator.count if estimator.done else max(discovered, estimator.count)
+        
+        def report(file_path, result, rendition=False):
+            nonlocal index
+            if not rendition:
+                index += 1
+                # 缓存命中的结果已有记录,再记录会重新计算内容哈希
+                fresh = result.success and not result.cached and (not result.skipped or result.kept_original)
+                if self.cache and fresh:
+                    self.cache.record(str(file_path), settings, self.target_size_kb, result)
+                if journal and fresh:
+                    journal.record(str(file_path))
+            summary.add(result)
+            if log:
+                log.write(result)
+            
+            if progress_callback:
+                progress_callback(index, total_files(), file_path.name, result)
+            
+            if duplicates and result.duplicate_of is None and str(file_path) in duplicates.waiting:
+                for waiting_path, waiting_out, waiting_stat in duplicates.waiting.pop(str(file_path)):
+                    report(Path(waiting_path), self._reuse_result(waiting_path, waiting_out, waiting_stat,
+                                                                  result, output_format, dedup_link))
+            # 只保存登记过的首个文件的结果,之后出现的重复文件直接复用
+            if duplicates and str(file_path) in duplicates.primaries:
+                duplicates.results[str(file_path)] = result
+        
+        def report_renditions(file_path, results):
+            """报告一个文件的全部规格,全部成功才算完成"""
+            nonlocal index
+            if not isinstance(results, list):
+                # 工作进程异常退出时只有一个失败结果
+                results = [results]
+            index += 1
+            for result in results:
+                report(file_path, result, rendition=True)
+            if journal and all(result.success for result in results):
+                journal.record(str(file_path))
+        
+        def pending():
+            """遍历文件,直接报告无需压缩的文件,产出待压缩任务"""
+            nonlocal discovered
+            for path_str, stat in iter_image_files(input_folder, recursive, self.SUPPORTED_FORMATS):
+                discovered += 1
+                file_path = Path(path_str)
+                out_file_str = self._output_file_for(file_path, input_path, output_path, output_format,
+                                                     created_dirs)
+                
+                if not renditions and stat.st_size <= self.threshold_bytes:
+                    report(file_path, self._threshold_skip_result(path_str, out_file_str, stat.st_size))
+                    continue
+                
+                if journal and path_str in journal:
+                    report(file_path, CompressionResult(
+                        success=True, skipped=True, input_path=path_str, output_path=out_file_str,
+                        original_size=stat.st_size, compressed_size=stat.st_size,
+                        message='上次运行中已完成，跳过'))
+                    continue
+                
+                if renditions:
+                    yield file_path, out_file_str, None
+                    continue
+                
+                cached, quality_hint = self._check_cache(path_str, out_file_str, settings, stat)
+                if cached:
+                    report(file_path, cached)
+                    continue
+                
+                if duplicates:
+                    try:
+                        primary = duplicates.primary_for(path_str, stat.st_size)
+                    except OSError as e:
+                        report(file_path, self._error_result(path_str, e))
+                        continue
+                    if primary in duplicates.results:
+                        report(file_path, self._reuse_result(path_str, out_file_str, stat,
+                                                             duplicates.results[primary], output_format, dedup_link))
+                        continue
+                    if primary:
+                        duplicates.waiting.setdefault(primary, []).append((path_str, out_file_str, stat))
+                        continue
+                
+                yield file_path, out_file_str, quality_hint
+        
+        finished = False
+        try:
+            if workers <= 1:
+                for file_path, out_file_str, quality_hint in pending():
+                    if renditions:
+                        report_renditions(file_path, self.compress_renditions(
+                            str(file_path), renditions, out_file_str, output_format))
+                    else:
+                        report(file_path, self.compress_file(str(file_path), out_file_str, output_format,
+                                                             quality_hint))
+            else:
+                self._compress_parallel(pending(), output_format, workers,
+                                        report_renditions if renditions else report,
+                                        memory_budget_mb, renditions)
+            finished = True
+        finally:
+            if journal:
+                journal.close(finished)
+            if estimator:
+                estimator.stop()
+            if self.cache:
+                self.cache.flush()
+            if log:
+                log.close()
+        
+        return summary
+    
+    def _reuse_result(self, input_path: str, output_path: str, stat: os.stat_result,
+                      primary: CompressionResult, output_format: Optional[str],
+                      link: bool) -> CompressionResult:
+        """
+        内容相同的文件复用首个文件的压缩输出
         
-        # 先收集所有文件
-        all_files = [f for f in input_path.glob(pattern) 
-                     if f.is_file() and f.suffix.lower() in self.SUPPORTED_FORMATS]
+        首个文件失败或未压缩时,照常压缩这个文件
+        """
+        if not primary.success or primary.skipped:
+            return self.compress_file(input_path, output_path, output_format)
+        try:
+            linked = self._copy_output(primary.output_path, output_path, link)
+        except OSError as e:
+            return self._error_result(input_path, e)
+        return CompressionResult(
+            success=True,
+            input_path=input_path,
+            output_path=output_path,
+            original_size=stat.st_size,
+            compressed_size=primary.compressed_size,
+            quality=primary.quality,
+            encodes=0,
+            duplicate_of=primary.input_path,
+            message=(f'{stat.st_size/1024:.1f}KB → {primary.compressed_size/1024:.1f}KB '
+                     f'(与 {primary.input_path} 内容相同,{"硬链接" if linked else "复制"}其结果)')
+        )
+    
+    @staticmethod
+    def _copy_output(source: str, destination: str, link: bool) -> bool:
+        """把已写好的输出复制或硬链接到另一位置,返回是否使用了硬链接"""
+        if link:
+            temp_path = os.path.join(os.path.dirname(os.path.abspath(destination)),
+                                     f'.{os.path.basename(destination)}.{os.getpid()}.link.tmp')
+            try:
+                os.link(source, temp_path)
+                os.replace(temp_path, destination)
+                return True
+            except OSError:
+                # 跨文件系统或不支持硬链接时退回复制
+                if os.path.lexists(temp_path):
+                    os.remove(temp_path)
+        with open(source, 'rb') as src:
+            write_atomic(destination, lambda f: shutil.copyfileobj(src, f, 1024 * 1024))
+        return False
+    
+    def _compress_parallel(self, pending, output_format: Optional[str], workers: int, report,
+                           memory_budget_mb: Optional[float] = None,
+                           renditions: Optional[List[Rendition]] = None):
+        """
+        用进程池并行压缩,按完成顺序报告结果
         
-        total_files = len(all_files)
+        任务边遍历边提交,同时在途的任务数限制为进程数的2倍,
+        既能让进程池保持忙碌,也不会一次性为整个文件夹创建任务。
+        指定内存预算时,提交前先读文件头估计解码内存,预算不足就等待在途任务完成。
+        指定 renditions 时每个任务生成全部规格,报告的是结果列表
+        """
+        # Pillow 编码是CPU密集型且基本持有GIL,只有多进程才能利用多核
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_ignore_sigint)
+        max_in_flight = workers * 2
+        budget = memory_budget_mb * 1024 * 1024 if memory_budget_mb else None
+        futures = {}
+        in_use = 0
+        
+        def collect(done):
+            nonlocal in_use
+            for future in done:
+                file_path, memory = futures.pop(future)
+                in_use -= memory
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # 工作进程异常退出(如内存不足被杀)时记为失败
+                    result = self._error_result(str(file_path), e)
+                report(file_path, result)
         
-        for index, file_path in enumerate(all_files, 1):
-            if output_path:
-                relative_path = file_path.relative_to(input_path)
-                out_file = output_path / relative_path
-                out_file.parent.mkdir(parents=True, exist_ok=True)
-                
-                if output_format:
-                    ext = '.' + output_format.lower()
-                    if ext == '.jpeg':
-                        ext = '.jpg'
-                    out_file = out_file.with_suffix(ext)
+        try:
+            for file_path, out_file_str, quality_hint in pending:
+                memory = self.estimate_memory(str(file_path)) if budget else 0
+                # 超过整个预算的图片会一直等到没有在途任务,然后单独运行
+                while futures and (len(futures) >= max_in_flight or (budget and in_use + memory > budget)):
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    collect(done)
                 
-                out_file_str = str(out_file)
-            else:
-                out_file_str = str(file_path)
-            
-            result = self.compress_file(str(file_path), out_file_str, output_format)
-            results.append(result)
+                if renditions:
+                    future = executor.submit(self.compress_renditions, str(file_path), renditions,
+                                             out_file_str, output_format)
+                else:
+                    future = executor.submit(self.compress_file, str(file_path), out_file_str, output_format,
+                                             quality_hint)
+                futures[future] = (file_path, memory)
+                in_use += memory
             
+            collect(as_completed(list(futures)))
+        except BaseException:
+            _terminate_pool(executor)
+            raise
+        
+        executor.shutdown()
+    
+    def watch_folder(self, input_folder: str, output_folder: Optional[str] = None,
+                     recursive: bool = True, output_format: Optional[str] = None,
+                     progress_callback=None, workers: Optional[int] = None,
+                     settle_seconds: float = 2.0, poll_interval: Optional[float] = None,
+                     result_log: Optional[str] = None, stop_event: Optional[threading.Event] = None,
+                     on_ready=None) -> CompressionSummary:
+        """
+        持续监视文件夹,新增或修改的图片写完后立即压缩
+        
+        文件在 settle_seconds 内没有新的事件且大小、修改时间不变才视为写完,避免压缩上传了一半的文件。
+        压缩结果的大小和修改时间会被记住,覆盖原文件或输出到被监视的文件夹时不会再次处理自己的输出。
+        只处理启动后出现的文件,已有文件应先用 compress_folder 处理
+        
+        Args:
+            settle_seconds: 文件静止多久后开始压缩
+            poll_interval: 强制使用轮询并指定间隔(秒);默认在 Linux 上使用 inotify
+            stop_event: 被设置后停止监视并返回;按 Ctrl+C 同样会停止
+            on_ready: 开始监视后调用,参数为所用的监视方式('inotify' 或 'polling')
+        
+        Returns:
+            停止监视时的运行汇总
+        """
+        input_path = Path(input_folder)
+        if not input_path.is_dir():
+            raise ValueError(f"输入文件夹不存在: {input_folder}")
+        output_path = Path(output_folder) if output_folder else None
+        if output_path:
+            output_path.mkdir(parents=True, exist_ok=True)
+        
+        summary = CompressionSummary()
+        settings = self.settings_key(output_format)
+        log = ResultLog(result_log) if result_log else None
+        created_dirs = set()
+        watcher = FolderWatcher(input_folder, recursive, self.SUPPORTED_FORMATS, poll_interval,
+                                exclude=output_folder)
+        executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1, initializer=_ignore_sigint)
+        
+        waiting = {}   # 路径 -> (可以开始压缩的时间, 最近一次看到的大小和修改时间)
+        handled = {}   # 路径 -> 处理完成时的大小和修改时间,包括压缩写出的文件
+        futures = {}
+        index = 0
+        
+        def signature(path):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+            return stat.st_size, stat.st_mtime_ns
+        
+        def report(file_path, result):
+            nonlocal index
+            index += 1
+            if (self.cache and result.success and not result.cached
+                    and (not result.skipped or result.kept_original)):
+                self.cache.record(str(file_path), settings, self.target_size_kb, result)
+            handled[str(file_path)] = signature(str(file_path))
+            if result.output_path:
+                handled[result.output_path] = signature(result.output_path)
+            summary.add(result)
+            if log:
+                log.write(result)
             if progress_callback:
-                progress_callback(index, total_files, file_path.name, result)
+                progress_callback(index, index, file_path.name, result)
+        
+        def start(path, current):
+            file_path = Path(path)
+            out_file_str = self._output_file_for(file_path, input_path, output_path, output_format,
+                                                 created_dirs)
+            if current[0] <= self.threshold_bytes:
+                report(file_path, self._threshold_skip_result(path, out_file_str, current[0]))
+                return
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return
+            cached, quality_hint = self._check_cache(path, out_file_str, settings, stat)
+            if cached:
+                report(file_path, cached)
+                return
+            future = executor.submit(self.compress_file, path, out_file_str, output_format, quality_hint)
+            futures[future] = file_path
         
-        return results
+        try:
+            if on_ready:
+                on_ready(watcher.backend)
+            while not (stop_event and stop_event.is_set()):
+                now = time.monotonic()
+                timeout = min([deadline for deadline, _ in waiting.values()], default=now + 1.0) - now
+                timeout = min(max(timeout, 0), 1.0)
+                if futures:
+                    timeout = min(timeout, 0.1)
+                
+                for path in watcher.poll(timeout):
+                    current = signature(path)
+                    if current is not None and handled.get(path) != current:
+                        waiting[path] = (time.monotonic() + settle_seconds, current)
+                
+                now = time.monotonic()
+                busy = {str(file_path) for file_path in futures.values()}
+                for path, (deadline, seen) in list(waiting.items()):
+                    if deadline > now or path in busy:
+                        continue
+                    current = signature(path)
+                    if current is None or handled.get(path) == current:
+                        del waiting[path]
+                    elif current != seen:
+                        waiting[path] = (now + settle_seconds, current)
+                    else:
+                        del waiting[path]
+                        start(path, current)
+                
+                for future in [future for future in futures if future.done()]:
+                    file_path = futures.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = self._error_result(str(file_path), e)
+                    report(file_path, result)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            _terminate_pool(executor)
+            watcher.close()
+            if self.cache:
+                self.cache.flush()
+            if log:
+                log.close()
+        
+        return summary
+    
+    def estimate_memory(self, input_path: str) -> int:
+        """
+        只读文件头估计压缩一张图片的峰值内存(字节)
+        
+        Pillow 的RGB/RGBA图像每像素占4字节;解码图像、模式转换后的副本和缩放结果
+        可能同时存在,按 MEMORY_BYTES_PER_PIXEL 估计。JPEG 按 draft 缩小后的解码尺寸计算,
+        可流式读取的 TIFF 按一个解码区域加缩小后的尺寸计算;这里假定预测的降采样会被确认,
+        未确认时压缩会重新按原尺寸解码,实际占用更高。
+        打不开的文件记为0,由压缩时报告错误
+        """
+        try:
+            with self.open_image(input_path) as img:
+                if img.format == 'JPEG':
+                    # draft 只改变解码尺寸,不会解码像素
+                    self.reduce_on_load(img, os.path.getsize(input_path))
+                elif img.format == 'TIFF' and self._tiff_row_groups(img, 1) is not None:
+                    # 流式读取时只同时存在一个解码区域和缩小后的图片
+                    factor = int(1 / self.predict_scale(img, os.path.getsize(input_path)))
+                    if factor >= 2:
+                        return (math.ceil(img.width / factor) * math.ceil(img.height / factor)
+                                * self.MEMORY_BYTES_PER_PIXEL + self.STREAM_REGION_BYTES)
+                return img.width * img.height * self.MEMORY_BYTES_PER_PIXEL
+        except Exception:
+            return 0
+    
+    def _check_cache(self, input_path: str, output_path: str, settings: str,
+                     stat: os.stat_result) -> Tuple[Optional[CompressionResult], Optional[int]]:
+        """
+        查询增量缓存
+        
+        Returns:
+            (可直接使用的跳过结果或None, 可复用的质量提示或None)
+        """
+        if self.cache is None:
+            return None, None
+        
+        entry = self.cache.lookup(input_path, settings)
+        if entry is None or entry['output_path'] != output_path:
+            return None, None
+        
+        if not self.cache.is_unchanged(entry, input_path, stat):
+            return None, None
+        if not entry['in_place'] and not os.path.exists(output_path):
+            return None, None
+        
+        # 大小与原文件相同的记录是 size_guard 保留原文件的结果
+        kept = entry['compressed_size'] == entry['original_size']
+        if entry['target_kb'] == self.target_size_kb:
+            if kept:
+                message = '文件未变化，上次已保留原文件，跳过'
+            else:
+                message = f'文件未变化，沿用上次结果 {entry["compressed_size"]/1024:.1f}KB (质量 {entry["quality"]})，跳过'
+            return CompressionResult(
+                success=True,
+                skipped=True,
+                cached=True,
+                kept_original=kept,
+                input_path=input_path,
+                output_path=output_path,
+                original_size=entry['original_size'],
+                compressed_size=entry['compressed_size'],
+                quality=None if kept else entry['quality'],
+                message=message
+            ), None
+        if kept:
+            return None, None
+        
+        # 原地模式下文件已是上次的压缩结果,上次的质量对它没有参考意义
+        change = abs(entry['target_kb'] - self.target_size_kb) / self.target_size_kb
+        if not entry['in_place'] and change <= self.HINT_TARGET_TOLERANCE:
+            return None, entry['quality']
+        
+        return None, None
 
 
 class ImageCompressorGUI:
     """图片压缩工具GUI界面"""
     
+    # 界面刷新间隔(毫秒),进度条和状态最多每秒刷新20次
+    UI_TICK_MS = 50
+    # 日志框最多保留的行数
+    MAX_LOG_LINES = 2000
+    
     def __init__(self, root):
         self.root = root
         self.root.title("图片批量压缩工具 - Image Compressor")
@@ -226,10 +2511,14 @@ class ImageCompressorGUI:
             'white': '#ffffff'         # 白色
         }
         
+        # 工作线程只向队列投递界面更新,由主线程定时批量处理
+        self.ui_queue = queue.Queue()
+        
         # 设置现代化样式
         self.setup_styles()
         self.setup_ui()
         self.is_processing = False
+        self.root.after(self.UI_TICK_MS, self.process_ui_queue)
     
     def setup_styles(self):
         """设置现代化样式"""
@@ -571,18 +2860,78 @@ class ImageCompressorGUI:
                                         activeforeground=self.colors['primary'])
         recursive_check.pack(side=tk.LEFT, padx=(0, 30))
         
+        # 代理探测
+        self.proxy_probe_var = tk.BooleanVar(value=False)
+        proxy_check = tk.Checkbutton(options_frame, 
+                                    text="🔍 代理探测(快速估算)",
+                                    variable=self.proxy_probe_var,
+                                    font=('Segoe UI', 10),
+                                    fg=self.colors['dark'],
+                                    bg=self.colors['white'],
+                                    selectcolor=self.colors['light'],
+                                    activebackground=self.colors['white'],
+                                    activeforeground=self.colors['primary'])
+        proxy_check.pack(side=tk.LEFT, padx=(0, 30))
+        
+        # 增量缓存
+        self.cache_var = tk.BooleanVar(value=False)
+        cache_check = tk.Checkbutton(options_frame, 
+                                    text="💾 增量缓存",
+                                    variable=self.cache_var,
+                                    font=('Segoe UI', 10),
+                                    fg=self.colors['dark'],
+                                    bg=self.colors['white'],
+                                    selectcolor=self.colors['light'],
+                                    activebackground=self.colors['white'],
+                                    activeforeground=self.colors['primary'])
+        cache_check.pack(side=tk.LEFT, padx=(0, 30))
+        
+        # 断点续传
+        self.resume_var = tk.BooleanVar(value=False)
+        resume_check = tk.Checkbutton(options_frame, 
+                                     text="⏯ 断点续传",
+                                     variable=self.resume_var,
+                                     font=('Segoe UI', 10),
+                                     fg=self.colors['dark'],
+                                     bg=self.colors['white'],
+                                     selectcolor=self.colors['light'],
+                                     activebackground=self.colors['white'],
+                                     activeforeground=self.colors['primary'])
+        resume_check.pack(side=tk.LEFT, padx=(0, 30))
+        
+        # 格式和并行设置
+        format_frame = tk.Frame(params_content, bg=self.colors['white'])
+        format_frame.grid(row=5, column=0, columnspan=3, sticky=tk.W, pady=(10, 0))
+        
         # 输出格式
-        tk.Label(options_frame, text="📄 输出格式:", 
+        tk.Label(format_frame, text="📄 输出格式:", 
                 font=('Segoe UI', 10),
                 fg=self.colors['dark'],
                 bg=self.colors['white']).pack(side=tk.LEFT, padx=(0, 10))
         
         self.format_var = tk.StringVar(value="保持原格式")
-        format_combo = ttk.Combobox(options_frame, textvariable=self.format_var, 
-                                   values=["保持原格式", "JPEG", "PNG", "WEBP"], 
+        format_combo = ttk.Combobox(format_frame, textvariable=self.format_var, 
+                                   values=["保持原格式"] + OUTPUT_FORMATS, 
                                    font=('Segoe UI', 10),
                                    width=12, state='readonly')
-        format_combo.pack(side=tk.LEFT)
+        format_combo.pack(side=tk.LEFT, padx=(0, 30))
+        
+        # 并行进程数
+        tk.Label(format_frame, text="⚡ 并行进程:", 
+                font=('Segoe UI', 10),
+                fg=self.colors['dark'],
+                bg=self.colors['white']).pack(side=tk.LEFT, padx=(0, 10))
+        
+        self.workers_var = tk.StringVar(value=str(os.cpu_count() or 1))
+        workers_spin = tk.Spinbox(format_frame, from_=1, to=256, 
+                                 textvariable=self.workers_var,
+                                 font=('Segoe UI', 10),
+                                 relief='flat',
+                                 bg=self.colors['light'],
+                                 fg=self.colors['dark'],
+                                 buttonbackground=self.colors['secondary'],
+                                 width=6)
+        workers_spin.pack(side=tk.LEFT)
         
         # 按钮区域
         button_frame = tk.Frame(main_frame, bg=self.colors['light'])
@@ -729,14 +3078,78 @@ class ImageCompressorGUI:
             self.output_folder_var.set(folder)
     
     def log(self, message, tag='info'):
-        """添加日志"""
+        """添加日志(线程安全,由界面刷新定时器批量写入日志框)"""
         timestamp = datetime.now().strftime("%H:%M:%S")
-        self.log_text.insert(tk.END, f"[{timestamp}] {message}\n", tag)
+        self.ui_queue.put(('log', f"[{timestamp}] {message}\n", tag))
+    
+    def set_progress(self, progress=None, status=None):
+        """更新进度条和状态(线程安全,每次刷新只应用最新的值)"""
+        self.ui_queue.put(('progress', progress, status))
+    
+    def call_in_ui(self, func, *args):
+        """在主线程中执行界面操作(线程安全)"""
+        self.ui_queue.put(('call', func, args))
+    
+    def process_ui_queue(self, reschedule=True):
+        """
+        处理界面更新队列
+        
+        一次取空队列:连续的日志行合并为一次插入且只保留最后 MAX_LOG_LINES 行,
+        进度只应用最后一次的值,避免逐文件刷新让界面卡顿
+        """
+        lines = deque(maxlen=self.MAX_LOG_LINES)
+        progress = status = None
+        
+        while True:
+            try:
+                kind, *payload = self.ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            
+            if kind == 'log':
+                lines.append(payload)
+            elif kind == 'progress':
+                progress = payload[0] if payload[0] is not None else progress
+                status = payload[1] if payload[1] is not None else status
+            else:
+                # 弹窗等操作前先把之前的日志写入
+                self._flush_log_lines(lines)
+                lines.clear()
+                func, args = payload
+                func(*args)
+        
+        self._flush_log_lines(lines)
+        if progress is not None:
+            self.progress_var.set(progress)
+        if status is not None:
+            self.status_var.set(status)
+        
+        if reschedule:
+            self.root.after(self.UI_TICK_MS, self.process_ui_queue)
+    
+    def _flush_log_lines(self, lines):
+        """把缓存的日志行一次性写入日志框,并裁剪到最多 MAX_LOG_LINES 行"""
+        if not lines:
+            return
+        
+        # 相邻同标签的行合并成一段,一次 insert 调用写入全部内容
+        segments = []
+        for text, tag in lines:
+            if segments and segments[-1] == tag:
+                segments[-2] += text
+            else:
+                segments.extend([text, tag])
+        self.log_text.insert(tk.END, *segments)
+        
+        # 每行以换行结尾,末尾还有一个空行
+        line_count = int(self.log_text.index('end-1c').split('.')[0]) - 1
+        if line_count > self.MAX_LOG_LINES:
+            self.log_text.delete('1.0', f'{line_count - self.MAX_LOG_LINES + 1}.0')
         self.log_text.see(tk.END)
-        self.root.update()
     
     def clear_log(self):
         """清空日志"""
+        self.process_ui_queue(reschedule=False)
         self.log_text.delete(1.0, tk.END)
         # 重新添加欢迎信息
         self.log("🎉 日志已清空!", 'summary')
@@ -777,6 +3190,13 @@ class ImageCompressorGUI:
             messagebox.showerror("错误", "质量范围必须在1-100之间，且最小值不能大于最大值!")
             return False
         
+        try:
+            if int(self.workers_var.get()) < 1:
+                raise ValueError()
+        except:
+            messagebox.showerror("错误", "并行进程数必须为正整数!")
+            return False
+        
         output = self.output_folder_var.get()
         if not output:
             response = messagebox.askyesno("警告", 
@@ -795,6 +3215,7 @@ class ImageCompressorGUI:
         self.start_button.config(state='disabled', bg='#636e72')
         self.stop_button.config(state='normal', bg='#d63031')
         self.progress_var.set(0)
+        self.process_ui_queue(reschedule=False)
         self.log_text.delete(1.0, tk.END)  # 清空日志
         
         # 在新线程中运行压缩
@@ -819,12 +3240,18 @@ class ImageCompressorGUI:
             max_quality = int(self.max_quality_var.get())
             recursive = self.recursive_var.get()
             output_format = None if self.format_var.get() == "保持原格式" else self.format_var.get()
+            workers = int(self.workers_var.get())
+            probe_mode = 'proxy' if self.proxy_probe_var.get() else 'full'
+            cache_path = os.path.join(input_folder, CACHE_FILENAME) if self.cache_var.get() else None
+            resume = self.resume_var.get()
+            journal_path = os.path.join(input_folder, JOURNAL_FILENAME) if resume else None
             
             self.log(f"🚀 开始处理图片...", 'info')
             self.log(f"📁 输入文件夹: {input_folder}", 'info')
             self.log(f"📏 阈值大小: {threshold} KB (只压缩超过此大小的文件)", 'info')
             self.log(f"🎯 目标大小: {target_size} KB", 'info')
             self.log(f"✨ 质量范围: {min_quality}-{max_quality}", 'info')
+            self.log(f"⚡ 并行进程: {workers}", 'info')
             if output_folder:
                 self.log(f"💾 输出文件夹: {output_folder}", 'info')
             else:
@@ -835,7 +3262,9 @@ class ImageCompressorGUI:
             compressor = ImageCompressor(
                 target_size_kb=target_size,
                 threshold_kb=threshold,
-                quality_range=(min_quality, max_quality)
+                quality_range=(min_quality, max_quality),
+                probe_mode=probe_mode,
+                cache_path=cache_path
             )
             
             # 定义进度回调
@@ -843,80 +3272,290 @@ class ImageCompressorGUI:
                 if not self.is_processing:
                     raise InterruptedError("用户取消操作")
                 
-                progress = (current / total) * 100
-                self.progress_var.set(progress)
-                self.status_var.set(f"🔄 处理中: {current}/{total} - {filename}")
+                self.set_progress((current / total) * 100, f"🔄 处理中: {current}/{total} - {filename}")
                 
-                if result['success']:
-                    if result.get('skipped', False):
-                        self.log(f"⊙ {filename}: {result['message']}", 'skip')
+                if result.success:
+                    if result.skipped:
+                        self.log(f"⊙ {filename}: {result.message}", 'skip')
                     else:
-                        self.log(f"✓ {filename}: {result['message']}", 'success')
+                        self.log(f"✓ {filename}: {result.message}", 'success')
                 else:
-                    self.log(f"✗ {filename}: {result['message']}", 'error')
+                    self.log(f"✗ {filename}: {result.message}", 'error')
             
             # 执行压缩
-            results = compressor.compress_folder(
-                input_folder=input_folder,
-                output_folder=output_folder,
-                recursive=recursive,
-                output_format=output_format,
-                progress_callback=progress_callback
-            )
+            try:
+                summary = compressor.compress_folder(
+                    input_folder=input_folder,
+                    output_folder=output_folder,
+                    recursive=recursive,
+                    output_format=output_format,
+                    progress_callback=progress_callback,
+                    workers=workers,
+                    estimate_total=True,
+                    journal_path=journal_path,
+                    resume=resume
+                )
+            finally:
+                compressor.close()
             
             # 生成摘要
             self.log("─" * 80, 'info')
             self.log("🎉 处理完成!", 'summary')
             self.log("─" * 80, 'info')
             
-            successful = [r for r in results if r['success'] and not r.get('skipped', False)]
-            skipped = [r for r in results if r['success'] and r.get('skipped', False)]
-            failed = [r for r in results if not r['success']]
-            
-            self.log(f"📊 总文件数: {len(results)}", 'summary')
-            self.log(f"✅ 已压缩: {len(successful)}", 'summary')
-            self.log(f"⊙ 已跳过: {len(skipped)}", 'summary')
-            self.log(f"❌ 失败: {len(failed)}", 'summary')
+            self.log(f"📊 总文件数: {summary.total}", 'summary')
+            self.log(f"✅ 已压缩: {summary.compressed}", 'summary')
+            self.log(f"⊙ 已跳过: {summary.skipped}", 'summary')
+            self.log(f"❌ 失败: {summary.failed}", 'summary')
             
-            if successful:
-                total_original = sum(r['original_size'] for r in successful)
-                total_compressed = sum(r['compressed_size'] for r in successful)
-                total_saved = total_original - total_compressed
-                avg_ratio = sum(r['compression_ratio'] for r in successful) / len(successful)
-                
+            if summary.compressed:
                 self.log(f"\n📈 压缩文件统计:", 'summary')
-                self.log(f"📦 原始总大小: {total_original/1024/1024:.2f} MB", 'summary')
-                self.log(f"📦 压缩后总大小: {total_compressed/1024/1024:.2f} MB", 'summary')
-                self.log(f"💾 节省空间: {total_saved/1024/1024:.2f} MB", 'summary')
-                self.log(f"📉 平均压缩率: {avg_ratio:.1f}%", 'summary')
-            
-            self.status_var.set("✅ 处理完成!")
-            self.progress_var.set(100)
-            messagebox.showinfo("🎉 完成", 
-                              f"处理完成!\n\n"
-                              f"✅ 已压缩: {len(successful)}\n"
-                              f"⊙ 已跳过: {len(skipped)}\n"
-                              f"❌ 失败: {len(failed)}")
+                self.log(f"📦 原始总大小: {summary.original_bytes/1024/1024:.2f} MB", 'summary')
+                self.log(f"📦 压缩后总大小: {summary.compressed_bytes/1024/1024:.2f} MB", 'summary')
+                self.log(f"💾 节省空间: {summary.saved_bytes/1024/1024:.2f} MB", 'summary')
+                self.log(f"📉 平均压缩率: {summary.average_ratio:.1f}%", 'summary')
+            
+            accuracy = summary.proxy_accuracy()
+            if accuracy['samples']:
+                self.log(f"\n🔍 代理探测精度 ({accuracy['samples']} 个样本):", 'summary')
+                self.log(f"📐 平均误差: {accuracy['mean_error']:+.1f}%  "
+                         f"平均绝对误差: {accuracy['mean_abs_error']:.1f}%  "
+                         f"最大: {accuracy['max_abs_error']:.1f}%", 'summary')
+                self.log(f"🎯 落在±5%窗口内: {accuracy['within_window'] * 100:.0f}%", 'summary')
+            
+            self.set_progress(100, "✅ 处理完成!")
+            self.call_in_ui(messagebox.showinfo, "🎉 完成", 
+                            f"处理完成!\n\n"
+                            f"✅ 已压缩: {summary.compressed}\n"
+                            f"⊙ 已跳过: {summary.skipped}\n"
+                            f"❌ 失败: {summary.failed}")
             
         except InterruptedError:
-            self.status_var.set("⏸️ 已取消")
-            self.progress_var.set(0)
+            self.set_progress(0, "⏸️ 已取消")
         except Exception as e:
             self.log(f"❌ 发生错误: {str(e)}", 'error')
-            self.status_var.set("❌ 发生错误")
-            messagebox.showerror("错误", f"处理过程中发生错误:\n{str(e)}")
+            self.set_progress(status="❌ 发生错误")
+            self.call_in_ui(messagebox.showerror, "错误", f"处理过程中发生错误:\n{str(e)}")
         finally:
             self.is_processing = False
-            self.start_button.config(state='normal', bg='#00b894')
-            self.stop_button.config(state='disabled', bg='#636e72')
+            self.call_in_ui(self.start_button.config, {'state': 'normal', 'bg': '#00b894'})
+            self.call_in_ui(self.stop_button.config, {'state': 'disabled', 'bg': '#636e72'})
 
 
-def main():
-    """主函数"""
+def _rendition_arg(text: str) -> Rendition:
+    """argparse 使用的规格解析,出错时显示具体原因"""
+    try:
+        return Rendition.parse(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """命令行参数"""
+    parser = argparse.ArgumentParser(
+        description='图片批量压缩工具:只压缩超过阈值的图片,并把它们压缩到目标大小附近。不带参数运行时打开图形界面')
+    parser.add_argument('input', nargs='?', help='输入文件夹或单个图片文件')
+    parser.add_argument('-o', '--output', help='输出文件夹(输入为单个文件时为输出文件);不指定则覆盖原文件')
+    parser.add_argument('-t', '--target', type=float, default=200, help='目标大小(KB),默认200')
+    parser.add_argument('--threshold', type=float, default=300, help='阈值大小(KB),只压缩超过此大小的图片,默认300')
+    parser.add_argument('--min-quality', type=int, default=20, help='最低质量,默认20')
+    parser.add_argument('--max-quality', type=int, default=95, help='最高质量,默认95')
+    parser.add_argument('-f', '--format', choices=OUTPUT_FORMATS, type=str.upper,
+                        help='输出格式,默认保持原格式')
+    parser.add_argument('--no-recursive', action='store_true', help='不处理子文件夹')
+    parser.add_argument('-j', '--workers', type=int, help='并行进程数,默认为CPU核心数')
+    parser.add_argument('--memory-budget', type=float, metavar='MB',
+                        help='并行时同时处理的图片预计占用内存上限(MB),超大图片单独处理')
+    parser.add_argument('--probe-mode', choices=['full', 'proxy'], default='full',
+                        help='探测模式:full 整图编码探测,proxy 分块拼图估算')
+    parser.add_argument('--effort', type=int, default=ImageCompressor.DEFAULT_EFFORT, choices=range(7),
+                        metavar='0-6', help='WebP/AVIF 最终编码力度,越高越慢、文件越小,默认4')
+    parser.add_argument('--probe-effort', type=int, choices=range(7), metavar='0-6',
+                        help='WebP/AVIF 探测编码力度,默认同 --effort;批量转换时可设为0加快搜索')
+    parser.add_argument('--png-dither', action='store_true', help='PNG 调色板量化时使用抖动(仅不透明图片)')
+    parser.add_argument('--size-guard', action='store_true',
+                        help='格式不变时重新编码不比原文件小就保留原文件(覆盖模式下不写盘),并记入缓存')
+    parser.add_argument('--keep-metadata', action='store_true', help='输出中保留原图的 EXIF 和 ICC 配置文件')
+    parser.add_argument('--auto-orient', action='store_true', help='按 EXIF 方向旋转图像,方向标记随之复位')
+    parser.add_argument('--proxy-pixels', type=int, default=1_000_000, help='代理探测拼图的像素数')
+    parser.add_argument('--cache', metavar='DB', help='增量缓存数据库路径,未变化的文件直接跳过')
+    parser.add_argument('--cache-content-hash', action='store_true', help='缓存额外记录内容哈希')
+    parser.add_argument('--json', action='store_true', help='每个文件输出一行JSON结果(汇总信息写到stderr)')
+    parser.add_argument('--log', metavar='PATH', help='结果日志文件(.jsonl 或 .csv),边处理边写入')
+    parser.add_argument('--journal', metavar='PATH',
+                        help=f'断点日志路径;指定 --resume 时默认为输入文件夹下的 {JOURNAL_FILENAME}')
+    parser.add_argument('--resume', action='store_true', help='记录任务进度,并从上次中断处继续')
+    parser.add_argument('--dedup', action='store_true',
+                        help='内容完全相同的图片只压缩一次,其余复制第一份的压缩结果')
+    parser.add_argument('--dedup-link', action='store_true',
+                        help='同 --dedup,但用硬链接代替复制(不支持时退回复制)')
+    parser.add_argument('--rendition', action='append', type=_rendition_arg, metavar='NAME:KB[:MAX[:FORMAT]]',
+                        help='多规格输出(可重复):每个文件只解码一次,按规格生成 文件名_NAME 输出,'
+                             'MAX 为最长边上限,如 --rendition thumb:30:320:WEBP --rendition full:500')
+    parser.add_argument('--watch', action='store_true',
+                        help='处理完已有文件后持续监视输入文件夹,新上传的图片写完后立即压缩(Ctrl+C 停止)')
+    parser.add_argument('--settle', type=float, default=2.0, metavar='SECONDS',
+                        help='监视模式下文件静止多久才视为写完,默认2秒')
+    parser.add_argument('--poll-interval', type=float, metavar='SECONDS',
+                        help='监视模式强制使用轮询及其间隔;默认在 Linux 上使用 inotify')
+    parser.add_argument('--profile', action='store_true',
+                        help='统计解码、模式转换、探测编码、缩放、写入等各阶段的耗时,结束时输出汇总')
+    parser.add_argument('-q', '--quiet', action='store_true', help='只输出失败的文件和汇总')
+    parser.add_argument('--gui', action='store_true', help='打开图形界面')
+    return parser
+
+
+def run_cli(args) -> int:
+    """
+    命令行模式
+    
+    Returns:
+        退出码:全部成功为0,有文件失败为1,被中断为130
+    """
+    if args.min_quality < 1 or args.max_quality > 100 or args.min_quality > args.max_quality:
+        print('错误: 质量范围必须在1-100之间，且最小值不能大于最大值', file=sys.stderr)
+        return 2
+    if args.watch and os.path.isfile(args.input):
+        print('错误: 监视模式的输入必须是文件夹', file=sys.stderr)
+        return 2
+    if args.rendition and args.watch:
+        print('错误: 监视模式不支持多规格输出', file=sys.stderr)
+        return 2
+    
+    compressor = ImageCompressor(
+        target_size_kb=args.target,
+        threshold_kb=args.threshold,
+        quality_range=(args.min_quality, args.max_quality),
+        probe_mode=args.probe_mode,
+        proxy_pixels=args.proxy_pixels,
+        cache_path=args.cache,
+        cache_content_hash=args.cache_content_hash,
+        profile=args.profile,
+        png_dither=args.png_dither,
+        effort=args.effort,
+        probe_effort=args.probe_effort,
+        size_guard=args.size_guard,
+        keep_metadata=args.keep_metadata,
+        auto_orient=args.auto_orient
+    )
+    summary_out = sys.stderr if args.json else sys.stdout
+    
+    def emit(filename, result):
+        if args.json:
+            print(json.dumps(result.to_dict(), ensure_ascii=False), flush=True)
+        elif not result.success:
+            print(f"✗ {filename}: {result.message}", flush=True)
+        elif not args.quiet:
+            mark = '⊙' if result.skipped else '✓'
+            print(f"{mark} {filename}: {result.message}", flush=True)
+    
+    try:
+        if os.path.isfile(args.input):
+            if args.rendition:
+                results = compressor.compress_renditions(args.input, args.rendition, args.output, args.format)
+            else:
+                results = [compressor.compress_file(args.input, args.output, args.format)]
+            summary = CompressionSummary()
+            log = ResultLog(args.log) if args.log else None
+            for result in results:
+                emit(os.path.basename(args.input), result)
+                summary.add(result)
+                if log:
+                    log.write(result)
+            if log:
+                log.close()
+        else:
+            journal_path = args.journal
+            if args.resume and not journal_path:
+                journal_path = os.path.join(args.input, JOURNAL_FILENAME)
+            summary = compressor.compress_folder(
+                input_folder=args.input,
+                output_folder=args.output,
+                recursive=not args.no_recursive,
+                output_format=args.format,
+                progress_callback=lambda current, total, filename, result: emit(filename, result),
+                workers=args.workers,
+                result_log=args.log,
+                journal_path=journal_path,
+                resume=args.resume,
+                memory_budget_mb=args.memory_budget,
+                dedup=args.dedup or args.dedup_link,
+                dedup_link=args.dedup_link,
+                renditions=args.rendition
+            )
+            if args.watch:
+                print_summary(summary, summary_out, args.json)
+                summary = compressor.watch_folder(
+                    input_folder=args.input,
+                    output_folder=args.output,
+                    recursive=not args.no_recursive,
+                    output_format=args.format,
+                    progress_callback=lambda current, total, filename, result: emit(filename, result),
+                    workers=args.workers,
+                    settle_seconds=args.settle,
+                    poll_interval=args.poll_interval,
+                    result_log=args.log,
+                    on_ready=lambda backend: print(f'正在监视 {args.input} ({backend}),按 Ctrl+C 停止',
+                                                   file=sys.stderr, flush=True)
+                )
+    except KeyboardInterrupt:
+        print('已中断', file=sys.stderr)
+        return 130
+    except ValueError as e:
+        print(f'错误: {e}', file=sys.stderr)
+        return 2
+    finally:
+        compressor.close()
+    
+    print_summary(summary, summary_out, args.json)
+    return 1 if summary.failed else 0
+
+
+def print_summary(summary: CompressionSummary, out, as_json: bool = False):
+    """输出命令行模式的运行汇总;as_json 为True时输出一行JSON"""
+    if as_json:
+        print(json.dumps(summary.to_dict(), ensure_ascii=False), file=out, flush=True)
+        return
+    print(f"总文件数: {summary.total}  已压缩: {summary.compressed}  已跳过: {summary.skipped}  "
+          f"失败: {summary.failed}", file=out)
+    if summary.deduplicated:
+        print(f"内容重复而复用结果: {summary.deduplicated}", file=out)
+    if summary.compressed:
+        print(f"原始总大小: {summary.original_bytes/1024/1024:.2f} MB  "
+              f"压缩后总大小: {summary.compressed_bytes/1024/1024:.2f} MB  "
+              f"节省空间: {summary.saved_bytes/1024/1024:.2f} MB  "
+              f"平均压缩率: {summary.average_ratio:.1f}%", file=out)
+    accuracy = summary.proxy_accuracy()
+    if accuracy['samples']:
+        print(f"代理探测精度: {accuracy['samples']}个样本  平均误差 {accuracy['mean_error']:+.1f}%  "
+              f"平均绝对误差 {accuracy['mean_abs_error']:.1f}%  最大绝对误差 {accuracy['max_abs_error']:.1f}%  "
+              f"±5%以内 {accuracy['within_window'] * 100:.0f}%", file=out)
+    if summary.stages:
+        print("各阶段耗时:", file=out)
+        for line in summary.stage_report():
+            print(f"  {line}", file=out)
+
+
+def run_gui():
+    """启动图形界面"""
+    _import_tk()
     root = tk.Tk()
     app = ImageCompressorGUI(root)
     root.mainloop()
 
 
+def main(argv: Optional[List[str]] = None) -> int:
+    """主函数:不带参数时打开图形界面,否则按命令行模式运行"""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    
+    if args.gui or args.input is None:
+        run_gui()
+        return 0
+    
+    return run_cli(args)
+
+
 if __name__ == '__main__':
-    main()
+    multiprocessing.freeze_support()
+    sys.exit(main())
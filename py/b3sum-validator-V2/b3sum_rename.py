@@ -41,14 +41,41 @@ def is_admin():
         # Linux/Mac: 检查是否为root用户
         return os.geteuid() == 0
 
+# 超过该大小的文件用内存映射 + 多线程计算哈希
+MMAP_THRESHOLD = 64 * 1024 * 1024
+# 小文件分块读取的块大小
+READ_CHUNK_SIZE = 1024 * 1024
+# 无法内存映射的大文件分块读取的块大小,块足够大多线程才有收益
+LARGE_READ_CHUNK_SIZE = 16 * 1024 * 1024
+
 def calculate_hash(file_path):
-    """计算文件的BLAKE3哈希值"""
-    hasher = blake3.blake3()
-    with open(file_path, 'rb') as f:
-        chunk = f.read(8192)
-        while chunk:
-            hasher.update(chunk)
-            chunk = f.read(8192)
+    """
+    计算文件的BLAKE3哈希值
+
+    大文件内存映射后由 blake3 多线程计算,速度受限于磁盘而不是单个CPU核心;
+    内存映射失败(如网络盘)或 blake3 版本过旧时退回按16MB分块读取。
+    小文件按1MB分块读取,线程开销不划算,保持单线程
+    """
+    if os.path.getsize(file_path) >= MMAP_THRESHOLD:
+        hasher = blake3.blake3(max_threads=blake3.blake3.AUTO)
+        try:
+            hasher.update_mmap(file_path)
+            return hasher.hexdigest()
+        except (OSError, AttributeError):
+            hasher = blake3.blake3(max_threads=blake3.blake3.AUTO)
+            return _hash_by_reading(hasher, file_path, LARGE_READ_CHUNK_SIZE)
+    return _hash_by_reading(blake3.blake3(), file_path, READ_CHUNK_SIZE)
+
+def _hash_by_reading(hasher, file_path, chunk_size):
+    """复用同一个缓冲区分块读取文件并更新哈希"""
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(file_path, 'rb', buffering=0) as f:
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            hasher.update(view[:size])
     return hasher.hexdigest()
 
 def rename_file(file_path):